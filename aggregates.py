@@ -0,0 +1,142 @@
+"""Per-target aggregates maintained incrementally over time buckets"""
+
+import collections
+import logging
+import types
+
+import history
+import histogram
+
+log = logging.getLogger(__name__)
+
+PERCENTILES = (("p50", 50), ("p95", 95), ("p99", 99), ("p999", 99.9))
+# Limits on work of one query and on memory of window cache
+MAX_WINDOWS = 1440
+MAX_WINDOW_SIZES = 8
+MAX_CACHED = 100000
+EMPTY = {"start": None, "count": 0, "availability": None, "loss": None,
+        "samples": 0} | {name: None for name, _ in PERCENTILES}
+
+class Aggregates:
+    """Counters and latencies per target and time bucket with window cache"""
+    def __init__(self, bucket_size=60, retention=86400):
+        self.bucket_size = bucket_size
+        self.retention = retention
+        self.buckets = {}
+        self.latest = {}
+        self.order = collections.deque()
+        # Cached results per window size, least recently used size first
+        self.cache = collections.OrderedDict()
+
+    def bucket_start(self, timestamp):
+        """Start of bucket containing timestamp"""
+        return int(timestamp) - int(timestamp) % self.bucket_size
+
+    def bucket(self, target, timestamp):
+        """Get bucket of target containing timestamp, creating it"""
+        start = self.bucket_start(timestamp)
+        target_buckets = self.buckets.setdefault(target, {})
+        bucket = target_buckets.get(start)
+        if bucket is None:
+            # Latency is kept as sparse histogram bucket counts
+            bucket = types.SimpleNamespace(count=0, failures=0,
+                    latency=collections.Counter())
+            target_buckets[start] = bucket
+            self.order.append((start, target))
+        return bucket
+
+    def record(self, timestamp, tester, target, result):
+        """Add result of tester for target to its bucket"""
+        value = history.to_value(result)
+        self.latest.setdefault(target, {})[tester] = (timestamp, value)
+        bucket = self.bucket(target, timestamp)
+        bucket.count += 1
+        if value < 0:
+            bucket.failures += 1
+        self.invalidate(target, timestamp)
+
+    def merge_histogram(self, timestamp, target, pairs):
+        """Add latency histogram sent by tester to bucket"""
+        self.bucket(target, timestamp).latency.update(dict(pairs))
+        self.invalidate(target, timestamp)
+
+    def invalidate(self, target, timestamp):
+        """Drop cached windows containing timestamp"""
+        for window, results in self.cache.items():
+            results.pop((target, int(timestamp) - int(timestamp) % window),
+                    None)
+
+    def expire(self, now):
+        """Drop buckets older than retention period"""
+        cutoff = now - self.retention
+        expired = False
+        while self.order and self.order[0][0] < cutoff:
+            start, target = self.order.popleft()
+            target_buckets = self.buckets.get(target, {})
+            target_buckets.pop(start, None)
+            if not target_buckets:
+                self.buckets.pop(target, None)
+            self.invalidate(target, start)
+            expired = True
+        if expired:
+            # Windows that ended before retention are never invalidated
+            for window, results in self.cache.items():
+                for key in [key for key in results
+                        if key[1] + window <= cutoff]:
+                    del results[key]
+
+    def compute(self, start, buckets):
+        """Aggregate buckets of one window"""
+        count = failures = 0
+        latency = histogram.Histogram()
+        for bucket in buckets:
+            count += bucket.count
+            failures += bucket.failures
+            latency.add(bucket.latency.items())
+        result = {"start": start, "count": count}
+        if count:
+            result["availability"] = (count - failures) / count * 100
+            result["loss"] = failures / count * 100
+        else:
+            result["availability"] = result["loss"] = None
+        result["samples"] = latency.total
+        for name, pct in PERCENTILES:
+            result[name] = latency.percentile(pct)
+        return result
+
+    def window(self, target, window, start):
+        """Get aggregate for one window, computing it at most once"""
+        results = self.cache.get(window)
+        if results is None:
+            if len(self.cache) >= MAX_WINDOW_SIZES:
+                self.cache.popitem(last=False)
+            results = self.cache[window] = collections.OrderedDict()
+        else:
+            self.cache.move_to_end(window)
+        key = (target, start)
+        result = results.get(key)
+        if result is not None:
+            results.move_to_end(key)
+            return result
+        target_buckets = self.buckets.get(target, {})
+        buckets = [bucket for bucket in map(target_buckets.get,
+            range(start, start + window, self.bucket_size)) if bucket]
+        if not buckets:
+            # Empty windows are cheap and would crowd out real ones
+            return dict(EMPTY, start=start)
+        # Windows of one size hold no more non-empty entries than there
+        # are buckets, so sweep over every target fits in cache
+        while len(results) >= max(MAX_CACHED, len(self.order)):
+            results.popitem(last=False)
+        result = results[key] = self.compute(start, buckets)
+        return result
+
+    def series(self, target, window, start, end):
+        """Aggregates of consecutive windows covering [start, end)"""
+        window = max(self.bucket_size, min(int(window), self.retention))
+        window -= window % self.bucket_size
+        first = int(start) - int(start) % window
+        if (int(end) - first) // window > MAX_WINDOWS:
+            raise ValueError(f"Range spans more than {MAX_WINDOWS} windows")
+        return [self.window(target, window, window_start)
+                for window_start in range(first, int(end), window)]
@@ -0,0 +1,107 @@
+"""Rolling baselines and anomaly detection over every target at once"""
+
+import logging
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import history
+
+log = logging.getLogger(__name__)
+
+# Deviation floor in seconds, so a very stable target is not flagged for
+# jitter of a fraction of millisecond
+MIN_DEVIATION = 1e-4
+
+class Baselines:
+    """EWMA latency mean, variance and loss rate of targets in arrays, one
+    column per tester and target as testers see targets over other paths"""
+    def __init__(self, alpha=0.1, zscore=4.0, loss=0.5, warmup=10,
+            capacity=1024):
+        self.alpha = alpha
+        self.zscore = zscore
+        self.loss_limit = loss
+        self.warmup = warmup
+        self.ids = {}
+        self.names = []
+        self.mean = numpy.zeros(capacity)
+        self.var = numpy.zeros(capacity)
+        self.loss = numpy.zeros(capacity)
+        # Samples of column, and successful samples behind latency baseline
+        self.count = numpy.zeros(capacity, dtype=numpy.int64)
+        self.samples = numpy.zeros(capacity, dtype=numpy.int64)
+        self.slow = numpy.zeros(capacity, dtype=bool)
+        self.lossy = numpy.zeros(capacity, dtype=bool)
+
+    def target_id(self, tester, name):
+        """Get column of target seen by tester, growing arrays when full"""
+        key = (tester, name)
+        target_id = self.ids.get(key)
+        if target_id is None:
+            target_id = len(self.names)
+            if target_id == len(self.mean):
+                for column in ("mean", "var", "loss", "count", "samples",
+                        "slow", "lossy"):
+                    array = getattr(self, column)
+                    setattr(self, column, numpy.concatenate(
+                        (array, numpy.zeros_like(array))))
+            self.ids[key] = target_id
+            self.names.append(name)
+        return target_id
+
+    def update(self, timestamp, tester, results):
+        """Fold stats update into baselines, return anomaly transitions"""
+        if not results:
+            return []
+        ids = numpy.fromiter((self.target_id(tester, name)
+            for name in results), dtype=numpy.int64, count=len(results))
+        values = numpy.fromiter((history.to_value(result)
+            for result in results.values()), dtype=float,
+            count=len(results))
+        failed = values < 0
+        self.loss[ids] += self.alpha * (failed - self.loss[ids])
+        self.count[ids] += 1
+        lossy = (self.count[ids] >= self.warmup) & (
+                self.loss[ids] > self.loss_limit)
+        events = self.transitions(timestamp, tester, ids, lossy, self.lossy,
+                "loss", self.loss[ids])
+        ids = ids[~failed]
+        values = values[~failed]
+        # First sample of target starts its baseline
+        first = self.samples[ids] == 0
+        self.mean[ids[first]] = values[first]
+        self.samples[ids] += 1
+        diff = values - self.mean[ids]
+        deviation = numpy.maximum(numpy.sqrt(self.var[ids]), MIN_DEVIATION)
+        zscores = numpy.abs(diff) / deviation
+        slow = (self.samples[ids] > self.warmup) & (zscores > self.zscore)
+        events.extend(self.transitions(timestamp, tester, ids, slow,
+            self.slow, "latency", zscores, values))
+        # Anomalous samples still move baseline, so lasting shift becomes
+        # new normal
+        self.mean[ids] += self.alpha * diff
+        self.var[ids] = (1 - self.alpha) * (self.var[ids] +
+                self.alpha * diff * diff)
+        return events
+
+    def transitions(self, timestamp, tester, ids, flags, column, kind,
+            scores, values=None):
+        """Store flags of targets, return events for changed ones"""
+        changed = numpy.flatnonzero(flags != column[ids])
+        column[ids] = flags
+        events = []
+        for index in changed:
+            target_id = ids[index]
+            event = {"type": "anomaly", "kind": kind,
+                    "target": self.names[target_id], "tester": tester,
+                    "anomalous": bool(flags[index]),
+                    "score": float(scores[index]), "time": timestamp}
+            if values is not None:
+                event["value"] = float(values[index])
+                event["baseline"] = float(self.mean[target_id])
+            events.append(event)
+        if events:
+            log.info("%s %s anomaly transitions", len(events), kind)
+        return events
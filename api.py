@@ -0,0 +1,144 @@
+"""Minimal non-blocking HTTP server driven by the monitor select loop"""
+
+import json
+import logging
+import socket
+import types
+import urllib.parse
+
+log = logging.getLogger(__name__)
+
+MAX_REQUEST = 8192
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found",
+        405: "Method Not Allowed", 431: "Request Header Fields Too Large",
+        503: "Service Unavailable"}
+
+def json_response(data, status=200):
+    """Build response tuple with JSON body"""
+    return (status, "application/json",
+            json.dumps(data).encode("utf-8"), {})
+
+def error_response(status, message):
+    """Build JSON error response"""
+    return json_response({"error": message}, status)
+
+class Server:
+    """HTTP endpoint, routes map path to handler(params, headers)"""
+    def __init__(self, ip_address, port, routes):
+        self.routes = routes
+        self.clients = {}
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.setblocking(False)
+        self.socket.bind((ip_address, port))
+        self.socket.listen()
+        log.info("Query endpoint listening on %s:%s", ip_address, port)
+
+    def owns(self, sock):
+        """Check if socket belongs to this server"""
+        return sock is self.socket or sock in self.clients
+
+    def process_read(self, sock, lists):
+        """Accept connection or read request from client"""
+        if sock is self.socket:
+            try:
+                client, address = self.socket.accept()
+            except OSError:
+                log.debug("Accept failed")
+                return
+            client.setblocking(False)
+            self.clients[client] = types.SimpleNamespace(sock=client,
+                    address=address, recieved=bytearray(), out=None, sent=0)
+            lists.read.append(client)
+            log.debug("Query connection from %s", address)
+            return
+        conn = self.clients[sock]
+        try:
+            data = sock.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.close(conn, lists)
+            return
+        conn.recieved += data
+        end = conn.recieved.find(b"\r\n\r\n")
+        if end < 0:
+            if len(conn.recieved) > MAX_REQUEST:
+                self.respond(conn, lists,
+                        error_response(431, "Request too large"))
+            return
+        response = self.handle(bytes(conn.recieved[:end]))
+        self.respond(conn, lists, response)
+
+    def handle(self, head):
+        """Parse request head and dispatch to route handler"""
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            return error_response(400, "Malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if method != "GET":
+            return error_response(405, "Only GET is supported")
+        url = urllib.parse.urlsplit(target)
+        handler = self.routes.get(url.path)
+        if not handler:
+            return error_response(404, f"Unknown path {url.path}")
+        params = urllib.parse.parse_qs(url.query)
+        try:
+            return handler(params, headers)
+        except (KeyError, ValueError) as error:
+            return error_response(400, f"Invalid parameters: {error}")
+
+    def respond(self, conn, lists, response):
+        """Queue response and register client for writing"""
+        status, content_type, body, extra_headers = response
+        head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+                f"Content-Type: {content_type}",
+                f"Content-Length: {len(body)}",
+                "Connection: close"]
+        head.extend(f"{name}: {value}"
+                for name, value in extra_headers.items())
+        # Body is sent from its own buffer to avoid copying large payloads
+        head = ("\r\n".join(head) + "\r\n\r\n").encode("latin-1")
+        conn.out = [head, body]
+        conn.sent = 0
+        lists.read.remove(conn.sock)
+        lists.write.append(conn.sock)
+
+    def process_write(self, sock, lists):
+        """Send pending response without blocking"""
+        conn = self.clients[sock]
+        while conn.out:
+            try:
+                conn.sent += sock.send(memoryview(conn.out[0])[conn.sent:])
+            except BlockingIOError:
+                return
+            except OSError:
+                log.debug("Query client %s gone", conn.address)
+                break
+            if conn.sent < len(conn.out[0]):
+                return
+            conn.out.pop(0)
+            conn.sent = 0
+        self.close(conn, lists)
+
+    def close(self, conn, lists):
+        """Close client connection"""
+        for sock_list in lists:
+            if conn.sock in sock_list:
+                sock_list.remove(conn.sock)
+        del self.clients[conn.sock]
+        conn.sock.close()
+
+    def shutdown(self):
+        """Close listening socket and clients"""
+        for sock in list(self.clients):
+            sock.close()
+        self.clients = {}
+        self.socket.close()
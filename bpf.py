@@ -0,0 +1,78 @@
+"""Assembly of classic BPF socket filters"""
+
+import ctypes
+import logging
+import socket
+import struct
+
+log = logging.getLogger(__name__)
+
+# Not exported by socket module
+SO_ATTACH_FILTER = 26
+
+# Instruction classes, sizes, modes and operations from linux/filter.h
+LD = 0x00
+LDX = 0x01
+ALU = 0x04
+JMP = 0x05
+RET = 0x06
+MISC = 0x07
+H = 0x08
+B = 0x10
+IND = 0x40
+MSH = 0xa0
+K = 0x00
+X = 0x08
+ADD = 0x00
+AND = 0x50
+LSH = 0x60
+JEQ = 0x10
+JGT = 0x20
+JGE = 0x30
+TAX = 0x00
+
+ACCEPT = 0xffffffff
+REJECT = 0
+
+class Program:
+    """Filter instructions, jumps refer to labels resolved on assembly"""
+    def __init__(self):
+        self.instructions = []
+        self.labels = {}
+
+    def label(self, name):
+        """Mark position of next instruction"""
+        self.labels[name] = len(self.instructions)
+
+    def op(self, code, k=0):
+        """Append instruction without jumps"""
+        self.instructions.append((code, None, None, k))
+
+    def jump(self, code, k, true, false):
+        """Append conditional jump to labels, None continues with next"""
+        self.instructions.append((code, true, false, k))
+
+    def target(self, position, label):
+        """Relative offset of label from instruction at position"""
+        if label is None:
+            return 0
+        offset = self.labels[label] - position - 1
+        if not 0 <= offset <= 0xff:
+            raise ValueError(f"Jump to {label} out of range")
+        return offset
+
+    def assemble(self):
+        """Encode program as array of sock_filter structures"""
+        return b"".join(struct.pack("HBBI", code,
+            self.target(position, true), self.target(position, false), k)
+            for position, (code, true, false, k)
+            in enumerate(self.instructions))
+
+def attach(sock, program):
+    """Attach assembled program to socket, replacing previous filter"""
+    count = len(program) // struct.calcsize("HBBI")
+    buffer = ctypes.create_string_buffer(program, len(program))
+    # sock_fprog is instruction count and pointer to instructions
+    fprog = struct.pack("HL", count, ctypes.addressof(buffer))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+    log.debug("Attached filter of %s instructions", count)
@@ -0,0 +1,98 @@
+"""Recording of frames received by monitor for later replay"""
+
+import logging
+import struct
+import time
+
+log = logging.getLogger(__name__)
+
+# Record: kind, seconds since capture start, connection id, data length
+RECORD_FORMAT = "<cdII"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+OPEN = b"O"
+FRAME = b"F"
+CLOSE = b"C"
+
+class Recorder:
+    """Append connection events and frames to capture file"""
+    def __init__(self, path, flush_size=65536, flush_interval=1):
+        self.path = path
+        # Capture is appended to, so restarted monitor extends it
+        self.file = open(path, "ab")
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.start = time.monotonic()
+        self.last_flush = self.start
+        self.next_id = 0
+        self.buffer = bytearray()
+
+    def record(self, kind, conn_id, data=b""):
+        """Buffer one record"""
+        self.buffer += struct.pack(RECORD_FORMAT, kind,
+                time.monotonic() - self.start, conn_id, len(data))
+        self.buffer += data
+        if len(self.buffer) >= self.flush_size:
+            self.flush()
+
+    def open(self, address):
+        """Record new connection and return its id"""
+        conn_id = self.next_id
+        self.next_id += 1
+        self.record(OPEN, conn_id, f"{address[0]}:{address[1]}".encode(
+            "ascii"))
+        return conn_id
+
+    def frames(self, conn_id, frames):
+        """Record frames received on connection"""
+        for frame in frames:
+            self.record(FRAME, conn_id, frame.encode("ascii"))
+
+    def close(self, conn_id):
+        """Record closed connection"""
+        self.record(CLOSE, conn_id)
+
+    def maybe_flush(self):
+        """Write buffered records if flush interval passed"""
+        if self.buffer and (time.monotonic() - self.last_flush >=
+                self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Write buffered records to file"""
+        if self.buffer:
+            self.file.write(self.buffer)
+            self.file.flush()
+            log.debug("Captured %s bytes", len(self.buffer))
+            self.buffer = bytearray()
+        self.last_flush = time.monotonic()
+
+    def shutdown(self):
+        """Flush and close capture file"""
+        self.flush()
+        self.file.close()
+
+def read(path):
+    """Yield (kind, offset, connection id, data) records of capture file"""
+    with open(path, "rb") as file:
+        data = file.read()
+    offset = 0
+    base = 0.0
+    last = 0.0
+    id_base = 0
+    next_id = 0
+    while offset + RECORD_SIZE <= len(data):
+        kind, time_offset, conn_id, length = struct.unpack_from(
+                RECORD_FORMAT, data, offset)
+        offset += RECORD_SIZE
+        if offset + length > len(data):
+            log.warning("Capture %s ends with torn record", path)
+            return
+        # Appended capture restarts its clock and connection ids
+        if time_offset + base < last:
+            base = last
+            id_base = next_id
+        last = time_offset + base
+        next_id = max(next_id, id_base + conn_id + 1)
+        yield kind, last, id_base + conn_id, bytes(
+                data[offset:offset + length])
+        offset += length
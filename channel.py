@@ -0,0 +1,152 @@
+"""Binary batches of results sent from ingest workers to aggregator"""
+
+import logging
+import struct
+import time
+
+import history
+import histogram
+
+log = logging.getLogger(__name__)
+
+# Name record: kind, id, length, followed by utf-8 name
+NAME_FORMAT = "<cII"
+# Update record: kind, timestamp, tester id, count, followed by samples
+UPDATE_FORMAT = "<cdII"
+# Sample: target id, value
+SAMPLE_FORMAT = "<Id"
+# Histogram record: kind, timestamp, tester id, target id, count, then pairs
+HISTOGRAM_FORMAT = "<cdIII"
+# Overload record: kind, timestamp, tester id, level, overrun, skipped
+OVERLOAD_FORMAT = "<cdIHdI"
+# Stale record: kind, timestamp, tester id
+STALE_FORMAT = "<cdI"
+NAME_SIZE = struct.calcsize(NAME_FORMAT)
+UPDATE_SIZE = struct.calcsize(UPDATE_FORMAT)
+SAMPLE_SIZE = struct.calcsize(SAMPLE_FORMAT)
+HISTOGRAM_SIZE = struct.calcsize(HISTOGRAM_FORMAT)
+OVERLOAD_SIZE = struct.calcsize(OVERLOAD_FORMAT)
+STALE_SIZE = struct.calcsize(STALE_FORMAT)
+PAIR_SIZE = struct.calcsize(histogram.PAIR_FORMAT)
+
+class Forwarder:
+    """Encode stats updates into batches and send them through a pipe"""
+    def __init__(self, conn, max_size=65536, interval=0.2):
+        self.conn = conn
+        self.max_size = max_size
+        self.interval = interval
+        self.ids = {}
+        self.batch = bytearray()
+        self.last_flush = time.monotonic()
+
+    def name_id(self, name):
+        """Get id of name, announcing new names in batch"""
+        name_id = self.ids.get(name)
+        if name_id is None:
+            name_id = len(self.ids)
+            self.ids[name] = name_id
+            raw = name.encode("utf-8")
+            self.batch += struct.pack(NAME_FORMAT, b"N", name_id, len(raw))
+            self.batch += raw
+        return name_id
+
+    def add(self, timestamp, tester, results):
+        """Append stats update of tester to batch"""
+        tester_id = self.name_id(tester)
+        samples = [(self.name_id(target), history.to_value(result))
+                for target, result in results.items()]
+        self.batch += struct.pack(UPDATE_FORMAT, b"U", timestamp, tester_id,
+                len(samples))
+        for sample in samples:
+            self.batch += struct.pack(SAMPLE_FORMAT, *sample)
+        if len(self.batch) >= self.max_size:
+            self.flush()
+
+    def add_histograms(self, timestamp, tester, histograms):
+        """Append latency histograms of tester to batch"""
+        tester_id = self.name_id(tester)
+        for target, pairs in histograms.items():
+            self.batch += struct.pack(HISTOGRAM_FORMAT, b"H", timestamp,
+                    tester_id, self.name_id(target), len(pairs))
+            for pair in pairs:
+                self.batch += struct.pack(histogram.PAIR_FORMAT, *pair)
+        if len(self.batch) >= self.max_size:
+            self.flush()
+
+    def add_overload(self, timestamp, tester, report):
+        """Append overload state of tester to batch"""
+        self.batch += struct.pack(OVERLOAD_FORMAT, b"O", timestamp,
+                self.name_id(tester), report["level"], report["overrun"],
+                report["skipped"])
+        if len(self.batch) >= self.max_size:
+            self.flush()
+
+    def add_stale(self, timestamp, tester):
+        """Append notice that tester stopped reporting to batch"""
+        self.batch += struct.pack(STALE_FORMAT, b"S", timestamp,
+                self.name_id(tester))
+
+    def maybe_flush(self):
+        """Send batch if flush interval passed"""
+        if self.batch and time.monotonic() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """Send batch to aggregator"""
+        if self.batch:
+            self.conn.send_bytes(self.batch)
+            log.debug("Forwarded batch of %s bytes", len(self.batch))
+            self.batch = bytearray()
+        self.last_flush = time.monotonic()
+
+class Receiver:
+    """Decode batches of one worker"""
+    def __init__(self):
+        self.names = {}
+
+    def decode(self, batch):
+        """Yield (kind, timestamp, tester, data) updates from batch"""
+        offset = 0
+        while offset < len(batch):
+            kind = batch[offset:offset + 1]
+            if kind == b"N":
+                _, name_id, length = struct.unpack_from(NAME_FORMAT, batch,
+                        offset)
+                offset += NAME_SIZE
+                self.names[name_id] = str(batch[offset:offset + length],
+                        "utf-8")
+                offset += length
+            elif kind == b"U":
+                _, timestamp, tester_id, count = struct.unpack_from(
+                        UPDATE_FORMAT, batch, offset)
+                offset += UPDATE_SIZE
+                results = {self.names[target_id]: value
+                        for target_id, value in struct.iter_unpack(
+                            SAMPLE_FORMAT,
+                            batch[offset:offset + count * SAMPLE_SIZE])}
+                offset += count * SAMPLE_SIZE
+                yield "stats", timestamp, self.names[tester_id], results
+            elif kind == b"H":
+                _, timestamp, tester_id, target_id, count = (
+                        struct.unpack_from(HISTOGRAM_FORMAT, batch, offset))
+                offset += HISTOGRAM_SIZE
+                pairs = list(struct.iter_unpack(histogram.PAIR_FORMAT,
+                    batch[offset:offset + count * PAIR_SIZE]))
+                offset += count * PAIR_SIZE
+                yield ("histograms", timestamp, self.names[tester_id],
+                        {self.names[target_id]: pairs})
+            elif kind == b"O":
+                _, timestamp, tester_id, level, overrun, skipped = (
+                        struct.unpack_from(OVERLOAD_FORMAT, batch, offset))
+                offset += OVERLOAD_SIZE
+                yield ("overload", timestamp, self.names[tester_id],
+                        {"level": level, "overrun": overrun,
+                            "skipped": skipped})
+            elif kind == b"S":
+                _, timestamp, tester_id = struct.unpack_from(STALE_FORMAT,
+                        batch, offset)
+                offset += STALE_SIZE
+                yield "stale", timestamp, self.names[tester_id], None
+            else:
+                log.error("Unknown record %s in batch, dropping rest", kind)
+                return
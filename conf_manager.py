@@ -71,3 +71,17 @@ def parse(conf):
                     helpers.to_json(parsed[key]['cookie']))
     log.debug("Done parsing conf, conf: \n%s\n", helpers.to_json(parsed))
     return parsed
+
+def option(conf, key, default, convert=str, section="general"):
+    """Get converted option from config section or default value"""
+    try:
+        value = conf[section][key]
+    except KeyError:
+        log.debug("Option %s not set, using %s", key, default)
+        return default
+    try:
+        return convert(value)
+    except (TypeError, ValueError):
+        log.error("Invalid value %s for option %s, using %s", value, key,
+                default)
+        return default
@@ -0,0 +1,84 @@
+"""Combined view of target status across testers"""
+
+import collections
+import logging
+import types
+
+import history
+
+log = logging.getLogger(__name__)
+
+class Consensus:
+    """Target is down when quorum of recently reporting testers fail it"""
+    def __init__(self, quorum=2, window=30):
+        self.quorum = quorum
+        self.window = window
+        self.targets = {}
+        # One entry per stats update: expiry time, tester, time, targets
+        self.expiry = collections.deque()
+
+    def evaluate(self, target, state, timestamp):
+        """Recompute target status from counters, return transition event"""
+        reporting = len(state.reports)
+        if not reporting:
+            status = "unknown"
+        elif state.failing >= min(self.quorum, reporting):
+            status = "down"
+        else:
+            status = "up"
+        if status == state.status:
+            return None
+        state.status = status
+        log.info("Target %s is %s, %s of %s testers failing", target,
+                status, state.failing, reporting)
+        return {"type": "status", "target": target, "status": status,
+                "failing": state.failing, "reporting": reporting,
+                "time": timestamp}
+
+    def update(self, timestamp, tester, results):
+        """Apply stats update of tester, return status transitions"""
+        events = []
+        for target, result in results.items():
+            failed = history.to_value(result) < 0
+            state = self.targets.get(target)
+            if state is None:
+                state = types.SimpleNamespace(reports={}, failing=0,
+                        status="unknown")
+                self.targets[target] = state
+            previous = state.reports.get(tester)
+            if previous and previous[1]:
+                state.failing -= 1
+            state.reports[tester] = (timestamp, failed)
+            if failed:
+                state.failing += 1
+            event = self.evaluate(target, state, timestamp)
+            if event:
+                events.append(event)
+        self.expiry.append((timestamp + self.window, tester, timestamp,
+            results.keys()))
+        return events
+
+    def forget(self, now, target, tester, timestamp=None):
+        """Drop report of tester, only if made at timestamp when given"""
+        state = self.targets.get(target)
+        if state is None:
+            return None
+        report = state.reports.get(tester)
+        if report is None or (timestamp is not None and
+                report[0] != timestamp):
+            return None
+        del state.reports[tester]
+        if report[1]:
+            state.failing -= 1
+        return self.evaluate(target, state, now)
+
+    def expire(self, now):
+        """Drop reports older than window, return status transitions"""
+        events = []
+        while self.expiry and self.expiry[0][0] <= now:
+            _, tester, timestamp, targets = self.expiry.popleft()
+            for target in targets:
+                event = self.forget(now, target, tester, timestamp)
+                if event:
+                    events.append(event)
+        return events
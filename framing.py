@@ -0,0 +1,100 @@
+"""Incremental reading and writing of newline terminated protocol frames"""
+
+import base64
+import collections
+import logging
+import zlib
+
+log = logging.getLogger(__name__)
+
+class FrameReader:
+    """Collect received chunks and split them into decoded frames"""
+    def __init__(self, chunk_size=65536, max_frame=64 * 1024 * 1024):
+        self.chunk = bytearray(chunk_size)
+        self.buffer = bytearray()
+        self.scanned = 0
+        self.max_frame = max_frame
+        self.frames = collections.deque()
+
+    def recv(self, sock):
+        """Read available data from socket, return number of bytes read"""
+        count = sock.recv_into(self.chunk)
+        if count:
+            with memoryview(self.chunk) as view:
+                self.feed(view[:count])
+        return count
+
+    def feed(self, data):
+        """Append data and decode every completed frame"""
+        self.buffer += data
+        start = 0
+        # Bytes before scanned offset are known to contain no separator
+        end = self.buffer.find(b"\n", self.scanned)
+        with memoryview(self.buffer) as view:
+            while end >= 0:
+                if end > start:
+                    try:
+                        self.frames.append(str(view[start:end], "ascii"))
+                    except UnicodeDecodeError:
+                        log.error("Dropping frame that is not ascii")
+                start = end + 1
+                end = self.buffer.find(b"\n", start)
+        if start:
+            # Deleting from the front of bytearray does not move the tail
+            del self.buffer[:start]
+        self.scanned = len(self.buffer)
+        if self.scanned > self.max_frame:
+            raise ValueError(f"Frame exceeds {self.max_frame} bytes")
+
+class FrameWriter:
+    """Outgoing buffers of a connection, sent without blocking"""
+    def __init__(self):
+        self.buffers = collections.deque()
+        self.sent = 0
+
+    def queue(self, data):
+        """Queue buffer, it is kept by reference until sent"""
+        if data:
+            self.buffers.append(data)
+
+    def has_data(self):
+        """Check if anything is waiting to be sent"""
+        return bool(self.buffers)
+
+    def send(self, sock):
+        """Send as much as socket accepts, return True when drained"""
+        while self.buffers:
+            with memoryview(self.buffers[0]) as view:
+                try:
+                    self.sent += sock.send(view[self.sent:])
+                except BlockingIOError:
+                    return False
+            if self.sent < len(self.buffers[0]):
+                return False
+            self.buffers.popleft()
+            self.sent = 0
+        return True
+
+class ConfigPayload:
+    """Config frame encoded once, compressed copy built on first use"""
+    def __init__(self, str_conf):
+        self.plain = str_conf.encode("ascii")
+        self.compressed = None
+
+    def frame(self, compressed=False):
+        """Return shared encoded frame"""
+        if not compressed:
+            return self.plain
+        if self.compressed is None:
+            self.compressed = (b"CONFIG_ZLIB:" + base64.b64encode(
+                zlib.compress(self.plain.rstrip(b"\n"))) + b"\n")
+            log.debug("Compressed config from %s to %s bytes",
+                    len(self.plain), len(self.compressed))
+        return self.compressed
+
+def decode_config(frame):
+    """Return JSON text of config frame, compressed or not"""
+    if frame.startswith("CONFIG_ZLIB:"):
+        return zlib.decompress(base64.b64decode(
+            frame[len("CONFIG_ZLIB:"):])).decode("ascii")
+    return frame
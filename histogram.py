@@ -0,0 +1,84 @@
+"""Fixed memory log-bucketed latency histograms"""
+
+import array
+import base64
+import math
+import struct
+
+# Buckets grow by 2%, so reported values are within 1% of recorded ones
+GROWTH = 1.02
+MIN_VALUE = 1e-5
+MAX_VALUE = 120.0
+BUCKETS = math.ceil(math.log(MAX_VALUE / MIN_VALUE, GROWTH)) + 1
+# Encoded histogram is a sequence of bucket index and count pairs
+PAIR_FORMAT = "<HI"
+
+def bucket_index(value):
+    """Bucket holding value, out of range values are clamped"""
+    if value <= MIN_VALUE:
+        return 0
+    return min(int(math.log(value / MIN_VALUE, GROWTH)), BUCKETS - 1)
+
+def bucket_value(index):
+    """Representative value of bucket"""
+    return MIN_VALUE * GROWTH ** (index + 0.5)
+
+def encode(pairs):
+    """Encode bucket index and count pairs as text"""
+    return base64.b64encode(b"".join(struct.pack(PAIR_FORMAT, *pair)
+        for pair in pairs)).decode("ascii")
+
+def decode(text):
+    """Decode bucket index and count pairs from text"""
+    return list(struct.iter_unpack(PAIR_FORMAT, base64.b64decode(text)))
+
+class Histogram:
+    """Counts of values per logarithmic bucket"""
+    def __init__(self):
+        self.counts = array.array("I", bytes(BUCKETS * 4))
+        self.total = 0
+
+    def record(self, value):
+        """Count one value"""
+        self.counts[bucket_index(value)] += 1
+        self.total += 1
+
+    def add(self, pairs):
+        """Add counts from bucket index and count pairs"""
+        for index, count in pairs:
+            if 0 <= index < BUCKETS:
+                self.counts[index] += count
+                self.total += count
+
+    def merge(self, other):
+        """Add counts of other histogram"""
+        self.add(other.pairs())
+
+    def pairs(self):
+        """Non-empty buckets as index and count pairs"""
+        if not self.total:
+            return []
+        return [(index, count) for index, count in enumerate(self.counts)
+                if count]
+
+    def encode(self):
+        """Compact text form of non-empty buckets"""
+        return encode(self.pairs())
+
+    def percentile(self, pct):
+        """Value below which pct percent of counted values fall"""
+        if not self.total:
+            return None
+        rank = max(math.ceil(pct / 100 * self.total), 1)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return bucket_value(index)
+        return bucket_value(BUCKETS - 1)
+
+    def clear(self):
+        """Reset all counts"""
+        if self.total:
+            self.counts = array.array("I", bytes(BUCKETS * 4))
+            self.total = 0
@@ -0,0 +1,214 @@
+"""Append-only columnar history of collected results"""
+
+import array
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+import types
+
+log = logging.getLogger(__name__)
+
+FAILED = -1.0
+# Column name and array typecode, every segment has one file per column
+COLUMNS = (("ts", "d"), ("tid", "I"), ("val", "d"))
+# Index record: first row, rows in batch, min and max timestamp
+INDEX_FORMAT = "<QIdd"
+INDEX_SIZE = struct.calcsize(INDEX_FORMAT)
+
+def to_value(result):
+    """Convert result sent by tester to stored sample value"""
+    if isinstance(result, bool):
+        # HTTP results carry no latency, only success
+        return 0.0 if result else FAILED
+    try:
+        return float(result)
+    except (TypeError, ValueError):
+        return FAILED
+
+def day_of(timestamp):
+    """Return segment name for timestamp"""
+    return time.strftime("%Y%m%d", time.gmtime(timestamp))
+
+class HistoryStore:
+    """Per-day segments of timestamp, target id and value columns"""
+    def __init__(self, path, batch_size=4096, flush_interval=5):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        os.makedirs(path, exist_ok=True)
+        self.targets = {}
+        self.names = []
+        # Names registered since targets file was last written
+        self.unsaved = 0
+        self.load_targets()
+        self.pending = {}
+        self.pending_count = 0
+        self.last_flush = time.monotonic()
+
+    def targets_path(self):
+        """Path to target name to id mapping"""
+        return os.path.join(self.path, "targets.json")
+
+    def segment_path(self, day, column):
+        """Path to column file of a segment"""
+        return os.path.join(self.path, f"{day}.{column}")
+
+    def load_targets(self):
+        """Read target names known to the store"""
+        try:
+            with open(self.targets_path(), "r", encoding="utf-8") as file:
+                self.names = json.load(file)
+        except FileNotFoundError:
+            self.names = []
+        except (OSError, json.JSONDecodeError):
+            log.error("Cannot read history targets from %s", self.path)
+            self.names = []
+        self.targets = {name: tid for tid, name in enumerate(self.names)}
+        log.debug("Loaded %s history targets", len(self.names))
+
+    def save_targets(self):
+        """Write target names, replacing file atomically"""
+        tmp_path = self.targets_path() + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(self.names, file)
+        os.replace(tmp_path, self.targets_path())
+
+    def target_id(self, name):
+        """Get id of target, registering new targets"""
+        tid = self.targets.get(name)
+        if tid is None:
+            tid = len(self.names)
+            self.names.append(name)
+            self.targets[name] = tid
+            self.unsaved += 1
+            log.debug("New history target %s with id %s", name, tid)
+        return tid
+
+    def append(self, timestamp, name, value):
+        """Buffer a sample, flushing when batch is full"""
+        day = day_of(timestamp)
+        batch = self.pending.get(day)
+        if batch is None:
+            batch = types.SimpleNamespace(**{column: array.array(code)
+                for column, code in COLUMNS})
+            self.pending[day] = batch
+        batch.ts.append(timestamp)
+        batch.tid.append(self.target_id(name))
+        batch.val.append(to_value(value))
+        self.pending_count += 1
+        if self.pending_count >= self.batch_size:
+            self.flush()
+
+    def maybe_flush(self):
+        """Flush buffered samples if flush interval passed"""
+        if (self.pending_count and
+                time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    def segment_rows(self, day):
+        """Return committed rows of a segment, truncating torn writes"""
+        sizes = {}
+        for column, code in COLUMNS:
+            try:
+                size = os.path.getsize(self.segment_path(day, column))
+            except FileNotFoundError:
+                size = 0
+            sizes[column] = (size, array.array(code).itemsize)
+        rows = min(size // itemsize for size, itemsize in sizes.values())
+        for column, (size, itemsize) in sizes.items():
+            if size > rows * itemsize:
+                log.warning("Truncating torn history column %s of %s",
+                        column, day)
+                os.truncate(self.segment_path(day, column), rows * itemsize)
+        return rows
+
+    def flush(self):
+        """Append buffered samples to segment files"""
+        # Ids of new targets must be known before samples using them
+        if self.unsaved:
+            self.save_targets()
+            log.debug("Saved %s new history targets", self.unsaved)
+            self.unsaved = 0
+        for day, batch in self.pending.items():
+            start_row = self.segment_rows(day)
+            for column, _ in COLUMNS:
+                with open(self.segment_path(day, column), "ab") as file:
+                    getattr(batch, column).tofile(file)
+            # Index record is written last, it commits the batch
+            with open(self.segment_path(day, "idx"), "ab") as file:
+                file.write(struct.pack(INDEX_FORMAT, start_row,
+                    len(batch.ts), min(batch.ts), max(batch.ts)))
+            log.debug("Flushed %s samples to history segment %s",
+                    len(batch.ts), day)
+        self.pending = {}
+        self.pending_count = 0
+        self.last_flush = time.monotonic()
+
+    def days(self, start, end):
+        """List existing segments overlapping time range"""
+        first, last = day_of(start), day_of(end)
+        days = []
+        for file_name in os.listdir(self.path):
+            day, _, ext = file_name.partition(".")
+            if ext == "idx" and first <= day <= last:
+                days.append(day)
+        return sorted(days)
+
+    def read_index(self, day):
+        """Read index records of a segment"""
+        with open(self.segment_path(day, "idx"), "rb") as file:
+            raw = file.read()
+        raw = raw[:len(raw) - len(raw) % INDEX_SIZE]
+        return list(struct.iter_unpack(INDEX_FORMAT, raw))
+
+    def query_segment(self, day, start, end, wanted):
+        """Yield samples of one segment, reading only matching batches"""
+        rows = self.segment_rows(day)
+        if not rows:
+            return
+        maps = {}
+        files = []
+        try:
+            for column, _ in COLUMNS:
+                file = open(self.segment_path(day, column), "rb")
+                files.append(file)
+                maps[column] = mmap.mmap(file.fileno(), 0,
+                        access=mmap.ACCESS_READ)
+            for first, count, min_ts, max_ts in self.read_index(day):
+                if max_ts < start or min_ts >= end or first >= rows:
+                    continue
+                last = min(first + count, rows)
+                columns = {}
+                for column, code in COLUMNS:
+                    columns[column] = array.array(code)
+                    itemsize = columns[column].itemsize
+                    columns[column].frombytes(
+                            maps[column][first * itemsize:last * itemsize])
+                for timestamp, tid, value in zip(columns["ts"],
+                        columns["tid"], columns["val"]):
+                    if (start <= timestamp < end and
+                            (wanted is None or tid in wanted)):
+                        yield timestamp, self.names[tid], value
+        finally:
+            for mapped in maps.values():
+                mapped.close()
+            for file in files:
+                file.close()
+
+    def query(self, start, end, targets=None):
+        """Yield (timestamp, name, value) samples in [start, end)"""
+        wanted = None
+        if targets is not None:
+            wanted = {self.targets[name] for name in targets
+                    if name in self.targets}
+        for day in self.days(start, end):
+            yield from self.query_segment(day, start, end, wanted)
+        for day in sorted(self.pending):
+            batch = self.pending[day]
+            for timestamp, tid, value in zip(batch.ts, batch.tid, batch.val):
+                if (start <= timestamp < end and
+                        (wanted is None or tid in wanted)):
+                    yield timestamp, self.names[tid], value
@@ -15,9 +15,19 @@ from icmp_spec import type_codes
 import timer
 import ip
 import helpers
+import bpf
 
 BIG_ENDIAN = 0
 LITTLE_ENDIAN = 1
+ECHO_REPLY = 0
+DESTINATION_UNREACHABLE = 3
+ECHO_REQUEST = 8
+TIME_EXCEEDED = 11
+TIMESTAMP_REQUEST = 13
+TIMESTAMP_REPLY = 14
+# Reply type expected for every request type
+REPLY_TYPES = {ECHO_REQUEST: ECHO_REPLY, TIMESTAMP_REQUEST: TIMESTAMP_REPLY}
+ERROR_TYPES = (DESTINATION_UNREACHABLE, TIME_EXCEEDED)
 
 log = logging.getLogger(__name__)
 
@@ -50,6 +60,99 @@ def sixteen_bit_complement(seq, endianess=BIG_ENDIAN):
     log.debug("Checksum: %s", checksum)
     return checksum
 
+def address_to_int(address):
+    """Convert dotted ip address to integer"""
+    return struct.unpack("!I", socket.inet_aton(address))[0]
+
+def int_to_address(value):
+    """Convert integer to dotted ip address"""
+    return socket.inet_ntoa(struct.pack("!I", value))
+
+def open_socket():
+    """Create non-blocking raw ICMP socket with IP header included"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_HDRINCL, 1)
+    sock.setblocking(False)
+    return sock
+
+def pack_ip_header(source, destination, payload_length):
+    """Pack IPv4 header for ICMP payload, addresses are integers"""
+    header = struct.pack('!2B3H2BH2I', 0x45, 0, 20 + payload_length, 0, 0,
+            64, socket.IPPROTO_ICMP, 0, source, destination)
+    checksum = sixteen_bit_complement(header)
+    return header[:10] + struct.pack('!H', checksum) + header[12:]
+
+def pack_request(icmp_type, identifier, sequence, data=b''):
+    """Pack Echo or Timestamp request with computed checksum"""
+    if icmp_type == TIMESTAMP_REQUEST:
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+        originate = int((now - now.replace(hour=0, minute=0, second=0,
+            microsecond=0)).total_seconds() * 1000)
+        data = struct.pack('!3I', originate, 0, 0)
+    packet = struct.pack('!2B3H', icmp_type, 0, 0, identifier,
+            sequence) + data
+    checksum = sixteen_bit_complement(packet)
+    return packet[:2] + struct.pack('!H', checksum) + packet[4:]
+
+def parse_reply(packet):
+    """Return type, identifier and sequence of reply or of request that
+    caused error, None if packet is not a query reply or error"""
+    try:
+        offset = (packet[0] & 0x0f) * 4
+        icmp_type = packet[offset]
+        if icmp_type in ERROR_TYPES:
+            # Error carries IP header and first bytes of original request
+            offset += 8
+            offset += (packet[offset] & 0x0f) * 4
+        identifier, sequence = struct.unpack_from('!HH', packet, offset + 4)
+    except (IndexError, struct.error):
+        return None
+    return icmp_type, identifier, sequence
+
+def reply_filter(first, count):
+    """BPF program accepting replies, and errors about requests, whose
+    identifier is one of count identifiers starting at first"""
+    program = bpf.Program()
+    # X is offset of ICMP header, after IP header of variable length
+    program.op(bpf.LDX | bpf.B | bpf.MSH, 0)
+    program.op(bpf.LD | bpf.B | bpf.IND, 0)
+    program.jump(bpf.JMP | bpf.JEQ | bpf.K, ECHO_REPLY, "identifier", None)
+    program.jump(bpf.JMP | bpf.JEQ | bpf.K, TIMESTAMP_REPLY, "identifier",
+            None)
+    program.jump(bpf.JMP | bpf.JEQ | bpf.K, DESTINATION_UNREACHABLE, "error",
+            None)
+    program.jump(bpf.JMP | bpf.JEQ | bpf.K, TIME_EXCEEDED, "error", "reject")
+    program.label("error")
+    # Move X to ICMP header of request quoted after error header
+    program.op(bpf.LD | bpf.B | bpf.IND, 8)
+    program.op(bpf.ALU | bpf.AND | bpf.K, 0x0f)
+    program.op(bpf.ALU | bpf.LSH | bpf.K, 2)
+    program.op(bpf.ALU | bpf.ADD | bpf.X)
+    program.op(bpf.ALU | bpf.ADD | bpf.K, 8)
+    program.op(bpf.MISC | bpf.TAX)
+    program.op(bpf.LD | bpf.B | bpf.IND, 0)
+    program.jump(bpf.JMP | bpf.JEQ | bpf.K, ECHO_REQUEST, "identifier", None)
+    program.jump(bpf.JMP | bpf.JEQ | bpf.K, TIMESTAMP_REQUEST, "identifier",
+            "reject")
+    program.label("identifier")
+    if count >= 0x10000:
+        program.op(bpf.RET | bpf.K, bpf.ACCEPT)
+    else:
+        last = (first + count - 1) & 0xffff
+        program.op(bpf.LD | bpf.H | bpf.IND, 4)
+        if last >= first:
+            program.jump(bpf.JMP | bpf.JGE | bpf.K, first, None, "reject")
+        else:
+            # Range wraps around, identifier is either above first or
+            # below last
+            program.jump(bpf.JMP | bpf.JGE | bpf.K, first, "accept", None)
+        program.jump(bpf.JMP | bpf.JGT | bpf.K, last, "reject", "accept")
+    program.label("accept")
+    program.op(bpf.RET | bpf.K, bpf.ACCEPT)
+    program.label("reject")
+    program.op(bpf.RET | bpf.K, bpf.REJECT)
+    return program.assemble()
+
 class ICMP(abc.ABC):
     """Abstract class for ICMP requests"""
     identifier = 0
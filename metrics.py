@@ -0,0 +1,138 @@
+"""Prometheus text exposition kept up to date line by line"""
+
+import gzip
+import logging
+import time
+
+import history
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+FAMILIES = (
+    ("watchwolf_probe_up", "Last probe of target by tester succeeded"),
+    ("watchwolf_probe_rtt_seconds", "Round trip time of last probe"),
+)
+TESTER_FAMILIES = (
+    ("watchwolf_tester_overload_level", "Overload level reported by tester"),
+    ("watchwolf_tester_lap_overrun_seconds",
+        "Time by which last lap of tester exceeded its budget"),
+    ("watchwolf_tester_skipped_probes", "Probes skipped in last lap"),
+)
+
+def escape(label):
+    """Escape label value for text format"""
+    return (label.replace("\\", "\\\\").replace("\"", "\\\"")
+            .replace("\n", "\\n"))
+
+class Exposition:
+    """Rendered series lines, only changed series are re-rendered"""
+    def __init__(self, compress=True, interval=5):
+        self.compress = compress
+        # Changed body is joined and compressed at most once per interval
+        self.interval = interval
+        self.slots = {}
+        self.labels = []
+        self.values = []
+        self.lines = [[] for _ in FAMILIES]
+        self.headers = [f"# HELP {name} {description}\n# TYPE {name} gauge\n"
+                .encode("utf-8") for name, description in FAMILIES]
+        self.tester_headers = [f"# HELP {name} {description}\n"
+                f"# TYPE {name} gauge\n".encode("utf-8")
+                for name, description in TESTER_FAMILIES]
+        # Rendered lines of every tester family, keyed by tester
+        self.testers = {}
+        self.body = None
+        self.gzipped = None
+        self.changed = False
+        self.built = 0
+
+    def render(self, slot):
+        """Render lines of one series into its slot"""
+        up, rtt = self.values[slot]
+        labels = self.labels[slot]
+        self.lines[0][slot] = f"{FAMILIES[0][0]}{labels} {up}\n".encode(
+                "utf-8")
+        self.lines[1][slot] = (f"{FAMILIES[1][0]}{labels} {rtt!r}\n".encode(
+            "utf-8") if rtt is not None else b"")
+
+    def update(self, tester, target, result):
+        """Set latest result of a series"""
+        value = history.to_value(result)
+        values = (int(value >= 0), value if value > 0 else None)
+        key = (tester, target)
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = len(self.labels)
+            self.slots[key] = slot
+            self.labels.append(f"{{tester=\"{escape(tester)}\","
+                    f"target=\"{escape(target)}\"}}")
+            self.values.append(None)
+            for family_lines in self.lines:
+                family_lines.append(b"")
+        elif self.values[slot] == values:
+            return
+        self.values[slot] = values
+        self.render(slot)
+        self.changed = True
+
+    def overload(self, tester, level, overrun, skipped):
+        """Set overload state reported by tester"""
+        labels = f"{{tester=\"{escape(tester)}\"}}"
+        lines = [f"{name}{labels} {value!r}\n".encode("utf-8")
+                for (name, _), value in zip(TESTER_FAMILIES,
+                    (level, overrun, skipped))]
+        if self.testers.get(tester) == lines:
+            return
+        self.testers[tester] = lines
+        self.changed = True
+
+    def forget(self, tester, targets):
+        """Drop series of tester for targets it no longer reports"""
+        for target in targets:
+            slot = self.slots.get((tester, target))
+            if slot is None or self.values[slot] is None:
+                continue
+            # Slot is kept, tester that comes back reuses it
+            self.values[slot] = None
+            for family_lines in self.lines:
+                family_lines[slot] = b""
+        self.changed = True
+
+    def forget_tester(self, tester):
+        """Drop overload series of tester that stopped reporting"""
+        if self.testers.pop(tester, None) is not None:
+            self.changed = True
+
+    def payload(self, gzipped=False):
+        """Return body, joining and compressing only after changes and
+        serving previous body until interval passes"""
+        now = time.monotonic()
+        if self.body is None or (self.changed and
+                now - self.built >= self.interval):
+            parts = []
+            for header, family_lines in zip(self.headers, self.lines):
+                parts.append(header)
+                parts.extend(family_lines)
+            if self.testers:
+                for family, header in enumerate(self.tester_headers):
+                    parts.append(header)
+                    parts.extend(lines[family]
+                            for lines in self.testers.values())
+            self.body = b"".join(parts)
+            self.gzipped = None
+            self.changed = False
+            self.built = now
+            log.debug("Rendered exposition of %s series", len(self.labels))
+        if not gzipped:
+            return self.body
+        if self.gzipped is None:
+            self.gzipped = gzip.compress(self.body, compresslevel=1)
+        return self.gzipped
+
+    def handle(self, _params, headers):
+        """Serve exposition as query endpoint route"""
+        use_gzip = (self.compress and
+                "gzip" in headers.get("accept-encoding", ""))
+        extra_headers = {"Content-Encoding": "gzip"} if use_gzip else {}
+        return (200, CONTENT_TYPE, self.payload(use_gzip), extra_headers)
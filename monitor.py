@@ -5,56 +5,209 @@ import socket
 import select
 import types
 import json
+import struct
+import time
+import math
 import multiprocessing
 import collections
 
 import helpers
+import conf_manager
+import history
+import aggregates
+import api
+import query
+import metrics
+import framing
+import sharding
+import consensus
+import channel
+import thresholds
+import overload
+import subscriptions
+import histogram
+import capture
+import analytics
+import wheel
 
 def recv_data(tester, log, sock):
     """Recieve data from tester"""
-    recieved = b""
     try:
-        recieved = sock.recv(4096)
+        recieved = tester.reader.recv(sock)
+    except ValueError as error:
+        log.error("Closing connection with %s: %s", tester.address, error)
+        tester.close = True
+        return None
     except OSError:
         log.warning("Error reading data from %s", tester.address)
         return None
-    log.debug("Recieved %s from %s", recieved, tester.address)
-    tester.recieved += recieved
-    if "\n".encode("ascii") in tester.recieved:
-        log.debug("Recieved complete message from host %s", tester.address)
-        log.debug("Messages %s", tester.recieved)
-        tester.recieved = tester.recieved.decode("ascii")
-        last_completed = True
-        if tester.recieved[-1] != "\n":
-            log.debug("Last recieved message is incomplete")
-            last_completed = False
-        messages = tester.recieved.split("\n")
-        if last_completed:
-            tester.recieved = b""
-        else:
-            last = messages.pop()
-            tester.recieved = last.encode('ascii')
-        log.debug("Recieved messages %s", messages)
-        return messages
+    log.debug("Recieved %s bytes from %s", recieved, tester.address)
+    if tester.reader.frames:
+        log.debug("Recieved %s messages from host %s",
+                len(tester.reader.frames), tester.address)
+        return tester.reader.frames
 
     if not recieved:
         log.debug("Mark connection with %s to be closed", tester.address)
         tester.close = True
     return None
 
-def update_stats(log, request_value, tester, stats):
+def record_results(state, timestamp, tester_name, results):
+    """Feed results of tester to consumers, return change events"""
+    state.stats[tester_name] = results
+    state.stale.discard(tester_name)
+    for name, value in results.items():
+        state.aggregates.record(timestamp, tester_name, name, value)
+        state.metrics.update(tester_name, name, value)
+        if state.history:
+            state.history.append(timestamp, name, value)
+    events = state.consensus.update(timestamp, tester_name, results)
+    events.extend(state.thresholds.check(timestamp, tester_name, results))
+    if state.analytics:
+        events.extend(state.analytics.update(timestamp, tester_name, results))
+    state.hub.publish(events)
+
+def update_stats(log, request_value, tester, state):
     """Update statistics from recieved data from tester"""
     try:
-        stats.clear()
-        stats.update(json.loads(request_value))
-    except json.JSONDecodeError:
+        results = json.loads(request_value)
+        if not isinstance(results, dict):
+            raise ValueError("Stats are not an object")
+    except ValueError:
         log.error("Cannot parse stats from %s", tester.address)
-    log.debug("Stats \n%s\n", helpers.to_json(str(stats)))
+        return
+    timestamp = time.time()
+    if state.forwarder:
+        state.forwarder.add(timestamp, tester.name, results)
+    else:
+        record_results(state, timestamp, tester.name, results)
+    log.debug("Stats from %s \n%s\n", tester.name, helpers.to_json(results))
+
+def record_histograms(state, timestamp, histograms):
+    """Merge latency histograms of tester into aggregates"""
+    for target, pairs in histograms.items():
+        state.aggregates.merge_histogram(timestamp, target, pairs)
+
+def update_histograms(log, request_value, tester, state):
+    """Decode latency histograms recieved from tester"""
+    try:
+        histograms = {target: histogram.decode(encoded)
+                for target, encoded in json.loads(request_value).items()}
+    except (ValueError, AttributeError, TypeError, struct.error):
+        log.error("Cannot parse histograms from %s", tester.address)
+        return
+    timestamp = time.time()
+    if state.forwarder:
+        state.forwarder.add_histograms(timestamp, tester.name, histograms)
+    else:
+        record_histograms(state, timestamp, histograms)
+
+def record_overload(state, timestamp, tester_name, report):
+    """Expose overload state of tester and publish it to subscribers"""
+    state.metrics.overload(tester_name, report["level"], report["overrun"],
+            report["skipped"])
+    state.hub.publish([{"type": "overload", "tester": tester_name,
+        "level": report["level"], "overrun": report["overrun"],
+        "skipped": report["skipped"], "time": timestamp}])
 
-def process_request(log, requests, tester, stats):
+def update_overload(log, request_value, tester, state):
+    """Record overload state reported by tester"""
+    try:
+        report = json.loads(request_value)
+        report = {"level": int(report["level"]),
+                "overrun": float(report["overrun"]),
+                "skipped": int(report["skipped"])}
+        # Out of range fields would not fit in worker channel record
+        if not (0 <= report["level"] <= overload.MAX_LEVEL and
+                0 <= report["skipped"] <= 0xffffffff and
+                math.isfinite(report["overrun"]) and report["overrun"] >= 0):
+            raise ValueError("Overload report out of range")
+    except (ValueError, KeyError, TypeError, OverflowError):
+        log.error("Cannot parse overload report from %s", tester.address)
+        return
+    if report["level"]:
+        log.warning("Tester %s is overloaded, level %s", tester.name,
+                report["level"])
+    timestamp = time.time()
+    if state.forwarder:
+        state.forwarder.add_overload(timestamp, tester.name, report)
+    else:
+        record_overload(state, timestamp, tester.name, report)
+
+def mark_stale(state, timestamp, tester_name):
+    """Withdraw results of tester that stopped reporting"""
+    state.stale.add(tester_name)
+    results = state.stats.pop(tester_name, {})
+    state.metrics.forget(tester_name, results)
+    state.metrics.forget_tester(tester_name)
+    events = [{"type": "stale", "tester": tester_name, "time": timestamp}]
+    for target in results:
+        event = state.consensus.forget(timestamp, target, tester_name)
+        if event:
+            events.append(event)
+    state.hub.publish(events)
+
+def expire_testers(log, testers, lists, state):
+    """Close connections of testers silent for longer than timeout"""
+    # Wheel runs on monotonic clock, wall clock steps must not expire
+    # every tester at once
+    expired = state.liveness.advance(time.monotonic())
+    if not expired:
+        return
+    now = time.time()
+    log.warning("Closing %s idle connections", len(expired))
+    for address in expired:
+        tester = testers.get(address)
+        if tester is None:
+            continue
+        close_tester(log, tester, testers, lists, state)
+        # Tester may already be back on a new connection
+        if not tester.name or any(other.name == tester.name
+                for other in testers.values()):
+            continue
+        log.warning("Tester %s timed out, its results are stale",
+                tester.name)
+        if state.forwarder:
+            state.forwarder.add_stale(now, tester.name)
+        else:
+            mark_stale(state, now, tester.name)
+    if state.shards and state.shards.changed:
+        push_shards(log, testers, lists, state)
+
+def maintain(state):
+    """Periodic housekeeping done on every loop iteration"""
+    if state.capture:
+        state.capture.maybe_flush()
+    if state.forwarder:
+        state.forwarder.maybe_flush()
+        return
+    now = time.time()
+    state.aggregates.expire(now)
+    state.hub.publish(state.consensus.expire(now))
+    if state.history:
+        state.history.maybe_flush()
+
+def subscribe(log, request_value, tester, state):
+    """Turn connection into subscriber of change events"""
+    if not state.hub:
+        log.error("Subscriptions need a single ingest process, closing %s",
+                tester.address)
+        tester.close = True
+        return
+    try:
+        tester.subscriber = state.hub.subscribe(tester.sock, request_value)
+    except (ValueError, TypeError) as error:
+        log.error("Invalid subscription from %s: %s", tester.address, error)
+        tester.close = True
+        return
+    # Subscribers only listen, their silence is expected
+    if state.liveness:
+        state.liveness.remove(tester.address)
+
+def process_request(log, requests, tester, state):
     """Process requests from testers"""
     while requests:
-        request = requests.pop(0)
+        request = requests.popleft()
         log.debug("Processing request %s", request)
         request_name = ""
         request_value = ""
@@ -62,26 +215,42 @@ def process_request(log, requests, tester, stats):
             request_name, request_value = request.split(":", 1)
         except ValueError:
             log.error("Error parsing request from %s", tester.address)
-            return
+            continue
         if request_name == "NAME":
             log.debug("Set name to %s for %s", request_value, tester.address)
+            if state.shards and request_value != tester.name:
+                if tester.name:
+                    state.shards.leave(tester.name)
+                state.shards.join(request_value)
             tester.name = request_value
         elif request_name == "CONFIG_REQUEST":
             log.debug("Config request from %s", tester.address)
             tester.config_requested = True
+            tester.config_compressed = request_value == "zlib"
         elif request_name == "STATS_UPDATE":
             log.debug("Statistics update from %s", tester.address)
-            update_stats(log, request_value, tester, stats)
+            update_stats(log, request_value, tester, state)
+        elif request_name == "HISTOGRAM_UPDATE":
+            log.debug("Histogram update from %s", tester.address)
+            update_histograms(log, request_value, tester, state)
+        elif request_name == "OVERLOAD":
+            log.debug("Overload report from %s", tester.address)
+            update_overload(log, request_value, tester, state)
+        elif request_name == "SUBSCRIBE":
+            log.debug("Subscription request from %s", tester.address)
+            subscribe(log, request_value, tester, state)
 
 def accept_connection(log, server_socket):
     """Accept incoming connection from tester"""
     client, address = server_socket.accept()
     log.info("Accepting connection from %s", address)
     log.debug("Accepted peer name %s", client.getpeername())
+    client.setblocking(False)
     return types.SimpleNamespace(sock=client,
-            recieved=b"",data_to_sent=b"",name="",
+            reader=framing.FrameReader(),writer=framing.FrameWriter(),name="",
             address=client.getpeername(),close=False,
-            config_requested=False)
+            config_requested=False,config_compressed=False,subscriber=None,
+            capture_id=None)
 
 def close_connections(log, testers):
     """Close all established connections"""
@@ -91,7 +260,7 @@ def close_connections(log, testers):
         tester.sock.close()
     testers = {}
 
-def process_read(log, sock, testers, lists, stats):
+def process_read(log, sock, testers, lists, state):
     """Process ready read"""
     try:
         address = sock.getpeername()
@@ -102,62 +271,265 @@ def process_read(log, sock, testers, lists, stats):
     tester = testers[address]
     log.debug("Getting messages from %s", address)
     messages = recv_data(tester, log, sock)
+    if messages and state.liveness and not tester.subscriber:
+        state.liveness.touch(address, time.monotonic())
+    if messages and state.capture:
+        state.capture.frames(tester.capture_id, messages)
     if messages:
-        process_request(log, messages, tester, stats)
-    if tester.config_requested:
-        log.debug("Config request from %s", address)
-        if not sock in lists.write:
-            lists.write.append(sock)
+        process_request(log, messages, tester, state)
     if tester.close:
-        lists.read.remove(sock)
-        sock.close()
-        del testers[address]
-        log.debug("Connection with %s closed", address)
+        close_tester(log, tester, testers, lists, state)
+    # Pushing shards first, config payload would rebalance and lose which
+    # testers moved. Joining tester gets its config from the push too
+    if state.shards and state.shards.changed:
+        push_shards(log, testers, lists, state)
+    if not tester.close and tester.config_requested:
+        log.debug("Config request from %s", address)
+        queue_config(log, tester, lists, state)
+
+def close_tester(log, tester, testers, lists, state):
+    """Close connection and release everything held for it"""
+    if state.shards and tester.name:
+        state.shards.leave(tester.name)
+    if tester.subscriber:
+        state.hub.unsubscribe(tester.sock)
+    if state.capture:
+        state.capture.close(tester.capture_id)
+    if state.liveness:
+        state.liveness.remove(tester.address)
+    for sock_list in lists:
+        if tester.sock in sock_list:
+            sock_list.remove(tester.sock)
+    tester.sock.close()
+    del testers[tester.address]
+    log.debug("Connection with %s closed", tester.address)
+
+def forget_targets(state, tester_name, targets):
+    """Drop results of tester for targets moved to other testers"""
+    timestamp = time.time()
+    results = state.stats.get(tester_name, {})
+    state.stats[tester_name] = {target: value
+            for target, value in results.items() if target not in targets}
+    state.metrics.forget(tester_name, targets)
+    events = []
+    for target in targets:
+        latest = state.aggregates.latest.get(target, {})
+        latest.pop(tester_name, None)
+        if not latest:
+            state.aggregates.latest.pop(target, None)
+        event = state.consensus.forget(timestamp, target, tester_name)
+        if event:
+            events.append(event)
+    state.hub.publish(events)
 
-def process_write(log, sock, testers, lists, str_conf):
+def push_shards(log, testers, lists, state):
+    """Send new config to testers whose shards moved"""
+    moved = state.shards.rebalance()
+    for name, targets in state.shards.take_released().items():
+        log.debug("Forgetting %s targets moved off %s", len(targets), name)
+        forget_targets(state, name, targets)
+    for tester in testers.values():
+        if tester.name in moved and not tester.close:
+            log.debug("Shards of %s moved, pushing config", tester.name)
+            queue_config(log, tester, lists, state)
+
+def queue_config(log, tester, lists, state):
+    """Queue shared encoded config and register connection for writing"""
+    payload = state.config
+    if state.shards:
+        payload = state.shards.payload(tester.name)
+    frame = payload.frame(tester.config_compressed)
+    log.debug("Queueing config of %s bytes to %s", len(frame), tester.address)
+    tester.writer.queue(frame)
+    tester.config_requested = False
+    if not tester.sock in lists.write:
+        lists.write.append(tester.sock)
+
+def process_write(log, sock, testers, lists, state):
     """Process ready write"""
     try:
         address = sock.getpeername()
     except OSError:
         log.debug("Connection lost")
-        lists.write.remove(sock)
+        # Connection closed earlier in this loop iteration is already gone
+        if sock in lists.write:
+            lists.write.remove(sock)
+        return
+    tester = testers[address]
+    if tester.subscriber:
+        if not state.hub.process_write(sock, lists):
+            log.debug("Subscriber %s gone", address)
+            close_tester(log, tester, testers, lists, state)
         return
-    if testers[address].config_requested:
-        log.debug("Sending config to %s: \n%s\n", address,
-                helpers.to_json(str_conf))
-        testers[address].sock.sendall(str_conf.encode('ascii'))
-        testers[address].config_requested = False
+    try:
+        drained = tester.writer.send(sock)
+    except OSError:
+        log.warning("Error sending data to %s", address)
+        close_tester(log, tester, testers, lists, state)
+        return
+    if drained:
+        log.debug("All data sent to %s", address)
         lists.write.remove(sock)
 
-def testers_loop(server_socket, conf, log, stats):
+def testers_loop(server_socket, conf, log, state):
     """Main loop for connections from testers"""
-    str_conf = json.dumps(conf) + "\n"
+    state.config = framing.ConfigPayload(json.dumps(conf) + "\n")
     log.debug("Starting main loop")
     ListsType = collections.namedtuple("Lists", "read write")
     lists = ListsType([server_socket], [])
+    if state.api:
+        lists.read.append(state.api.socket)
     testers = {}
     while True:
         log.debug("Select lists: %s %s", lists.read, lists.write)
         log.debug("Testers dict: \n%s\n", testers)
         ready_read, ready_write, _ = select.select(lists.read, lists.write, [],
-                15)
+                1)
         for sock in ready_read:
             if sock == server_socket:
                 new_tester = accept_connection(log, server_socket)
+                if state.capture:
+                    new_tester.capture_id = state.capture.open(
+                            new_tester.address)
+                if state.liveness:
+                    state.liveness.touch(new_tester.address,
+                            time.monotonic())
                 testers[new_tester.address] = new_tester
                 lists.read.append(new_tester.sock)
+            elif state.api and state.api.owns(sock):
+                state.api.process_read(sock, lists)
             else:
-                process_read(log, sock, testers, lists, stats)
+                process_read(log, sock, testers, lists, state)
 
         for sock in ready_write:
-            process_write(log, sock, testers, lists, str_conf)
+            if state.api and state.api.owns(sock):
+                state.api.process_write(sock, lists)
+            else:
+                process_write(log, sock, testers, lists, state)
+
+        maintain(state)
+        if state.liveness:
+            expire_testers(log, testers, lists, state)
+        if state.hub:
+            state.hub.schedule(lists)
 
     close_connections(log, testers)
 
-def start(conf):
-    """Main loop"""
-    log = logging.getLogger(__name__)
-    log.debug("Starting monitor role with conf: \n%s\n", helpers.to_json(conf))
+def receive_batch(log, state, conn, workers, lists):
+    """Record results from batch sent by worker"""
+    try:
+        batch = conn.recv_bytes()
+    except (EOFError, OSError):
+        log.error("Ingest worker exited")
+        lists.read.remove(conn)
+        del workers[conn]
+        return
+    for kind, timestamp, tester_name, data in workers[conn].decode(batch):
+        if kind == "stats":
+            record_results(state, timestamp, tester_name, data)
+        elif kind == "overload":
+            record_overload(state, timestamp, tester_name, data)
+        elif kind == "stale":
+            mark_stale(state, timestamp, tester_name)
+        else:
+            record_histograms(state, timestamp, data)
+
+def aggregator_loop(log, state, workers):
+    """Main loop collecting results forwarded by ingest workers"""
+    log.debug("Starting aggregator loop")
+    ListsType = collections.namedtuple("Lists", "read write")
+    lists = ListsType(list(workers), [])
+    if state.api:
+        lists.read.append(state.api.socket)
+    while workers:
+        ready_read, ready_write, _ = select.select(lists.read, lists.write, [],
+                1)
+        for ready in ready_read:
+            if ready in workers:
+                receive_batch(log, state, ready, workers, lists)
+            else:
+                state.api.process_read(ready, lists)
+        for sock in ready_write:
+            state.api.process_write(sock, lists)
+        maintain(state)
+        state.hub.schedule(lists)
+    log.critical("All ingest workers exited")
+
+def worker_main(conf, index, conn):
+    """Ingest loop of worker process forwarding results to aggregator"""
+    log = logging.getLogger(f"{__name__}.worker{index}")
+    log.info("Starting ingest worker %s", index)
+    state = types.SimpleNamespace(stats={}, history=None, aggregates=None,
+            metrics=None, consensus=None, thresholds=None, hub=None,
+            shards=None, config=None, api=None,
+            forwarder=channel.Forwarder(conn),
+            capture=create_capture(log, conf, f".{index}"), analytics=None,
+            liveness=create_liveness(log, conf), stale=set())
+    server_socket = listen_socket(log, conf, reuse_port=True)
+    testers_loop(server_socket, conf, log, state)
+
+def create_history(log, conf):
+    """Open history store if history directory is configured"""
+    try:
+        path = conf["general"]["history_dir"]
+    except KeyError:
+        log.info("No history directory specified, history is disabled")
+        return None
+    log.info("Storing history in %s", path)
+    return history.HistoryStore(path, flush_interval=conf_manager.option(
+        conf, "history_flush", 5, float))
+
+def create_capture(log, conf, suffix=""):
+    """Open capture file if capturing received frames is configured"""
+    path = conf_manager.option(conf, "capture_file", None)
+    if path is None:
+        return None
+    # Every ingest worker writes its own capture
+    path += suffix
+    log.info("Capturing received frames to %s", path)
+    return capture.Recorder(path)
+
+def create_liveness(log, conf):
+    """Create idle timeout tracking of testers unless it is disabled"""
+    timeout = conf_manager.option(conf, "tester_timeout", 60, float)
+    if timeout <= 0:
+        log.info("Tester timeout disabled, idle testers are kept")
+        return None
+    return wheel.TimerWheel(timeout)
+
+def create_analytics(log, conf):
+    """Create target baselines if anomaly detection is enabled"""
+    if conf_manager.option(conf, "anomaly_detection", "no") != "yes":
+        return None
+    if analytics.numpy is None:
+        log.warning("Anomaly detection needs numpy, disabling it")
+        return None
+    return analytics.Baselines(
+            conf_manager.option(conf, "anomaly_alpha", 0.1, float),
+            conf_manager.option(conf, "anomaly_zscore", 4.0, float),
+            conf_manager.option(conf, "anomaly_loss", 0.5, float),
+            conf_manager.option(conf, "anomaly_warmup", 10, int))
+
+def create_shards(log, conf):
+    """Create target sharding if sharded mode is enabled"""
+    if conf_manager.option(conf, "shard", "no") != "yes":
+        return None
+    replicas = conf_manager.option(conf, "shard_replicas", 2, int)
+    log.info("Sharding targets across testers, %s testers per target",
+            replicas)
+    return sharding.Shards(conf, replicas)
+
+def create_api(log, conf, routes):
+    """Start query endpoint if its port is configured"""
+    port = conf_manager.option(conf, "api_port", None, int)
+    if port is None:
+        log.info("No api port specified, query endpoint is disabled")
+        return None
+    ip_address = conf_manager.option(conf, "api_ip", "127.0.0.1")
+    return api.Server(ip_address, port, routes)
+
+def listen_socket(log, conf, reuse_port=False):
+    """Create listening socket for testers"""
     ip_address = ""
     port = 5000
     try:
@@ -165,16 +537,88 @@ def start(conf):
     except KeyError:
         log.info("No listening ip specified, listening on all interfaces")
     try:
-        port = conf["general"]["port"]
+        port = int(conf["general"]["port"])
     except KeyError:
         log.info("No port specified, using port %s", port)
     log.debug("Start listening on address %s:%s", ip_address, port)
     conf_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if reuse_port:
+        # Kernel spreads connections across every socket bound to the port
+        conf_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     conf_socket.setblocking(False)
     conf_socket.bind((ip_address, port))
     conf_socket.listen()
+    return conf_socket
+
+def create_state(log, conf, ingest=True):
+    """Create monitor state holding consumers of results"""
     manager = multiprocessing.Manager()
-    stats = manager.dict()
-    testers_loop(conf_socket, conf, log, stats)
+    state = types.SimpleNamespace(stats=manager.dict(),
+            history=create_history(log, conf),
+            aggregates=aggregates.Aggregates(
+                conf_manager.option(conf, "aggregate_bucket", 60, int),
+                conf_manager.option(conf, "aggregate_retention", 86400, int)),
+            metrics=metrics.Exposition(
+                conf_manager.option(conf, "metrics_gzip", "yes") == "yes",
+                conf_manager.option(conf, "metrics_interval", 5, float)),
+            consensus=consensus.Consensus(
+                conf_manager.option(conf, "consensus_quorum", 2, int),
+                conf_manager.option(conf, "consensus_window", 30, float)),
+            thresholds=thresholds.Thresholds(conf, conf_manager.option(
+                conf, "latency_threshold", None, float)),
+            hub=subscriptions.Hub(),
+            shards=create_shards(log, conf) if ingest else None,
+            config=None, api=None, forwarder=None,
+            capture=create_capture(log, conf) if ingest else None,
+            analytics=create_analytics(log, conf),
+            liveness=create_liveness(log, conf) if ingest else None,
+            stale=set())
+    routes = query.routes(state)
+    routes["/metrics"] = state.metrics.handle
+    state.api = create_api(log, conf, routes)
+    return state
+
+def close_state(state):
+    """Flush history and capture and stop query endpoint"""
+    if state.history:
+        state.history.flush()
+    if state.capture:
+        state.capture.shutdown()
+    if state.api:
+        state.api.shutdown()
+
+def start_workers(log, conf, count):
+    """Run ingest worker processes and aggregate their results"""
+    if conf_manager.option(conf, "shard", "no") == "yes":
+        log.warning("Sharding needs a single ingest process, disabling it")
+    workers = {}
+    processes = []
+    for index in range(count):
+        recv_conn, send_conn = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=worker_main,
+                args=(conf, index, send_conn), daemon=True)
+        process.start()
+        send_conn.close()
+        workers[recv_conn] = channel.Receiver()
+        processes.append(process)
+    state = create_state(log, conf, ingest=False)
+    aggregator_loop(log, state, workers)
+    close_state(state)
+    for process in processes:
+        process.terminate()
+
+def start(conf):
+    """Main loop"""
+    log = logging.getLogger(__name__)
+    log.debug("Starting monitor role with conf: \n%s\n", helpers.to_json(conf))
+    workers_count = conf_manager.option(conf, "workers", 1, int)
+    if workers_count > 1:
+        log.info("Starting %s ingest workers", workers_count)
+        start_workers(log, conf, workers_count)
+        return
+    conf_socket = listen_socket(log, conf)
+    state = create_state(log, conf)
+    testers_loop(conf_socket, conf, log, state)
+    close_state(state)
     conf_socket.shutdown(socket.SHUT_RDWR)
     conf_socket.close()
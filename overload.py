@@ -0,0 +1,95 @@
+"""Tester overload detection and load shedding policies"""
+
+import logging
+
+import targets
+
+log = logging.getLogger(__name__)
+
+POLICIES = ("none", "shed", "stretch", "limit")
+MAX_LEVEL = 4
+# Laps must finish within this part of their budget, this many times in a
+# row, before level goes down
+RELIEF = 0.8
+RECOVERY_LAPS = 3
+
+class Controller:
+    """Overload level raised by overrun laps, and probes run at that level"""
+    def __init__(self, policy="none", lap_time=10, workers=5,
+            tcp_concurrency=1000):
+        self.policy = policy
+        self.lap_time = lap_time
+        self.workers = workers
+        self.tcp_concurrency = tcp_concurrency
+        self.level = 0
+        self.laps = 0
+        self.overrun = 0
+        self.skipped = 0
+        self.calm = 0
+        self.changed = False
+
+    def start_lap(self):
+        """Reset per lap counters"""
+        self.skipped = 0
+
+    def finish_lap(self, elapsed):
+        """Update overload level from time taken by lap"""
+        self.overrun = max(elapsed - self.lap_time, 0)
+        previous = self.level
+        if self.overrun:
+            self.level = min(self.level + 1, MAX_LEVEL)
+            self.calm = 0
+        elif elapsed < self.lap_time * RELIEF:
+            self.calm += 1
+            if self.calm >= RECOVERY_LAPS:
+                self.level = max(self.level - 1, 0)
+                self.calm = 0
+        else:
+            self.calm = 0
+        self.changed = self.level != previous
+        if self.changed:
+            log.warning("Overload level %s, lap took %.3f s of %s s",
+                    self.level, elapsed, self.lap_time)
+        self.laps += 1
+
+    def runs(self, table, probe):
+        """Check if probe runs in this lap"""
+        priority = table.priority[probe]
+        if priority == targets.PRIORITY_CRITICAL or not self.level:
+            return True
+        if self.policy == "shed":
+            # First level sheds low priority, next one normal priority too
+            return priority <= targets.PRIORITY_LOW - self.level
+        if self.policy == "stretch":
+            # Interval doubles per level, low priority stretches more
+            period = 2 ** (self.level + priority - 1)
+            return (probe + self.laps) % period == 0
+        return True
+
+    def select(self, table, probes):
+        """Split probes run in this lap into critical and other ones"""
+        critical = []
+        others = []
+        for probe in probes:
+            if table.priority[probe] == targets.PRIORITY_CRITICAL:
+                critical.append(probe)
+            elif self.runs(table, probe):
+                others.append(probe)
+            else:
+                self.skipped += 1
+        return critical, others
+
+    def limited(self):
+        """Check if other probes run after critical ones with less workers"""
+        return self.policy == "limit" and self.level > 0
+
+    def other_workers(self):
+        """Concurrency of probes that are not critical"""
+        if not self.limited():
+            return self.workers
+        return max(self.workers >> self.level, 1)
+
+    def report(self):
+        """Overload state reported to monitor"""
+        return {"level": self.level, "policy": self.policy,
+                "overrun": self.overrun, "skipped": self.skipped}
@@ -0,0 +1,79 @@
+"""Handlers for monitor query endpoint"""
+
+import functools
+import time
+
+import api
+
+# Last second of year 9999, history segments are named by date
+MAX_TIME = 253402300799
+
+def time_range(params, default_span=3600):
+    """Read start and end parameters, defaulting to last hour"""
+    end = float(params.get("end", [time.time()])[0])
+    start = float(params.get("start", [max(end - default_span, 0)])[0])
+    # Comparisons are false for nan too
+    if not 0 <= start <= MAX_TIME or not 0 <= end <= MAX_TIME:
+        raise ValueError(f"start and end must be from 0 to {MAX_TIME}")
+    if start > end:
+        raise ValueError("start is after end")
+    return start, end
+
+def status(state, params, _headers):
+    """Latest result of every tester for requested targets"""
+    targets = params.get("target", state.aggregates.latest.keys())
+    result = {}
+    for target in targets:
+        testers = state.aggregates.latest.get(target, {})
+        result[target] = {tester: {"time": timestamp, "value": value,
+            "stale": tester in state.stale}
+            for tester, (timestamp, value) in testers.items()}
+    return api.json_response(result)
+
+def samples(state, params, _headers):
+    """Raw samples of targets in time range from history"""
+    if not state.history:
+        return api.error_response(503, "History is disabled")
+    start, end = time_range(params)
+    limit = int(params.get("limit", [100000])[0])
+    result = {}
+    count = 0
+    for timestamp, name, value in state.history.query(start, end,
+            params.get("target")):
+        result.setdefault(name, []).append((timestamp, value))
+        count += 1
+        if count >= limit:
+            break
+    return api.json_response(result)
+
+def aggregate(state, params, _headers):
+    """Availability, loss and latency percentiles per window"""
+    aggregates = state.aggregates
+    start, end = time_range(params)
+    start = max(start, end - aggregates.retention)
+    window = int(params.get("window", [aggregates.bucket_size])[0])
+    targets = params.get("target", aggregates.buckets.keys())
+    result = {target: aggregates.series(target, window, start, end)
+            for target in targets}
+    return api.json_response(result)
+
+def target_consensus(state, params, _headers):
+    """Status of targets combined across testers"""
+    targets = params.get("target", state.consensus.targets.keys())
+    result = {}
+    for target in targets:
+        target_state = state.consensus.targets.get(target)
+        if target_state:
+            result[target] = {"status": target_state.status,
+                    "failing": target_state.failing,
+                    "reporting": len(target_state.reports)}
+    return api.json_response(result)
+
+def routes(state):
+    """Map endpoint paths to handlers bound to monitor state"""
+    return {
+        "/status": functools.partial(status, state),
+        "/range": functools.partial(samples, state),
+        "/aggregate": functools.partial(aggregate, state),
+        "/consensus": functools.partial(target_consensus, state),
+    }
@@ -0,0 +1,256 @@
+"""Replay captured tester traffic through monitor loop to measure it"""
+
+import argparse
+import collections
+import logging
+import socket
+import sys
+import threading
+import time
+import types
+
+import capture
+import conf_manager
+import histogram
+import monitor
+
+def parse_args(argv):
+    """Parse command line of replay tool"""
+    parser = argparse.ArgumentParser(description="Feed frames captured by "
+            "monitor back through its ingest path and report its speed")
+    parser.add_argument("config", help="monitor config file")
+    parser.add_argument("capture", help="capture file written by monitor")
+    parser.add_argument("--speed", type=float, default=0,
+            help="replay speed relative to capture, 0 replays at full speed")
+    parser.add_argument("--copies", type=int, default=1,
+            help="replay every connection this many times under new names")
+    parser.add_argument("--verbose", action="store_true",
+            help="log monitor messages")
+    return parser.parse_args(argv)
+
+class Finished(Exception):
+    """Raised inside monitor loop to end replay"""
+
+class ReplaySocket(socket.socket):
+    """Monitor end of replayed connection, peer name is captured address"""
+    def __init__(self, sock, address):
+        super().__init__(sock.family, sock.type, sock.proto, sock.detach())
+        self.address = address
+
+    def getpeername(self):
+        """Captured address, fails like closed socket of monitor would"""
+        super().getpeername()
+        return self.address
+
+class Listener:
+    """Stands in for server socket, monitor accepts replayed connections"""
+    def __init__(self):
+        self.wakeup, self.signal = socket.socketpair()
+        self.pending = collections.deque()
+        self.accepted = []
+        self.closed = False
+        self.finished = False
+
+    def fileno(self):
+        """Descriptor monitor selects on, readable while connections wait"""
+        return self.wakeup.fileno()
+
+    def connect(self, address):
+        """Queue connection from address, return its tester end"""
+        client, server = socket.socketpair()
+        if self.closed:
+            server.close()
+        else:
+            self.pending.append(ReplaySocket(server, address))
+            self.signal.send(b"C")
+        return client
+
+    def finish(self):
+        """Make monitor loop exit once queued connections are accepted"""
+        try:
+            self.signal.send(b"F")
+        except OSError:
+            # Monitor loop already stopped and closed listener
+            pass
+
+    def accept(self):
+        """Hand next queued connection to monitor"""
+        if self.wakeup.recv(1) == b"F":
+            self.finished = True
+            raise Finished()
+        sock = self.pending.popleft()
+        self.accepted.append(sock)
+        return sock, sock.address
+
+    def close(self):
+        """Close monitor ends, testers see connections closed"""
+        self.closed = True
+        for sock in self.accepted + list(self.pending):
+            sock.close()
+        self.wakeup.close()
+        self.signal.close()
+
+def run_monitor(log, conf, state, listener):
+    """Run monitor loop until replay finishes"""
+    try:
+        monitor.testers_loop(listener, conf, log, state)
+    except Finished:
+        pass
+    finally:
+        listener.close()
+
+def timed_requests(report, process_request):
+    """Wrap request processing of monitor to time every frame"""
+    def process(log, requests, tester, state):
+        while requests:
+            request = requests.popleft()
+            request_name = request.split(":", 1)[0]
+            started = time.perf_counter()
+            process_request(log, collections.deque((request,)), tester,
+                    state)
+            elapsed = time.perf_counter() - started
+            report.frames += 1
+            report.busy += elapsed
+            report.latency[request_name].record(elapsed)
+            report.latency["all"].record(elapsed)
+    return process
+
+def drain(sock, wait=False):
+    """Discard data sent by monitor, return False once it closed"""
+    flags = 0 if wait else socket.MSG_DONTWAIT
+    while True:
+        try:
+            data = sock.recv(65536, flags)
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+        if not data:
+            return False
+
+def send_frame(tester, data, report):
+    """Send one captured frame over tester connection"""
+    if tester.copy and data.startswith(b"NAME:"):
+        data += f"-{tester.copy}".encode("ascii")
+    try:
+        tester.sock.sendall(data + b"\n")
+    except OSError:
+        # Monitor closed connection, e.g. after invalid frame
+        report.dropped += 1
+        return
+    report.bytes += len(data) + 1
+    drain(tester.sock)
+
+def connect(listener, address, copy):
+    """Open replayed tester connection"""
+    return types.SimpleNamespace(sock=listener.connect(
+        (f"{address}#{copy}", 0)), copy=copy)
+
+def hang_up(tester):
+    """Close sending side, monitor reads rest of frames and closes"""
+    try:
+        tester.sock.shutdown(socket.SHUT_WR)
+    except OSError:
+        pass
+
+def feed(listener, records, args, report):
+    """Send capture records over replayed connections, hang up all of
+    them at the end and return them"""
+    testers = {}
+    closed = []
+    started = time.perf_counter()
+    for kind, offset, conn_id, data in records:
+        if args.speed:
+            delay = started + offset / args.speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                report.late = max(report.late, -delay)
+        for copy in range(args.copies):
+            key = (copy, conn_id)
+            if kind == capture.OPEN:
+                testers[key] = connect(listener, data.decode("ascii"), copy)
+            elif kind == capture.CLOSE:
+                tester = testers.pop(key, None)
+                if tester:
+                    hang_up(tester)
+                    closed.append(tester)
+            elif kind == capture.FRAME:
+                tester = testers.get(key)
+                if tester is None:
+                    tester = connect(listener, f"unknown{conn_id}", copy)
+                    testers[key] = tester
+                send_frame(tester, data, report)
+    for tester in testers.values():
+        hang_up(tester)
+    return closed + list(testers.values())
+
+def replay(log, conf, state, args):
+    """Feed capture through monitor loop, return report"""
+    report = types.SimpleNamespace(frames=0, bytes=0, dropped=0, busy=0,
+            late=0, latency=collections.defaultdict(histogram.Histogram))
+    listener = Listener()
+    process_request = monitor.process_request
+    monitor.process_request = timed_requests(report, process_request)
+    thread = threading.Thread(target=run_monitor,
+            args=(log, conf, state, listener), daemon=True)
+    thread.start()
+    started = time.perf_counter()
+    try:
+        testers = feed(listener, capture.read(args.capture), args, report)
+        # Monitor closes connection only after processing all its frames
+        for tester in testers:
+            drain(tester.sock, wait=True)
+            tester.sock.close()
+        report.wall = time.perf_counter() - started
+        listener.finish()
+        thread.join()
+    finally:
+        monitor.process_request = process_request
+    if not listener.finished:
+        raise RuntimeError("Monitor loop failed before replay finished")
+    return report
+
+def print_report(report):
+    """Print throughput and per frame latency distribution"""
+    print(f"Frames: {report.frames} ({report.bytes} bytes), "
+            f"dropped: {report.dropped}")
+    print(f"Wall time: {report.wall:.3f} s, busy time: {report.busy:.3f} s")
+    if report.wall:
+        print(f"Loop throughput: {report.frames / report.wall:.0f} frames/s,"
+                f" {report.bytes / report.wall / 1e6:.2f} MB/s")
+    if report.busy:
+        print(f"Ingest throughput: {report.frames / report.busy:.0f} frames/s,"
+                f" {report.bytes / report.busy / 1e6:.2f} MB/s")
+    if report.late:
+        print(f"Replay fell behind capture by up to {report.late:.3f} s")
+    print(f"{'frame':<20}{'count':>10}{'p50':>12}{'p99':>12}{'p999':>12}")
+    for name, frame_histogram in sorted(report.latency.items()):
+        print(f"{name:<20}{frame_histogram.total:>10}" + "".join(
+            f"{frame_histogram.percentile(pct) * 1e6:>10.1f}us"
+            for pct in (50, 99, 99.9)))
+
+def main(argv=None):
+    """Replay capture file given on command line"""
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    logging.basicConfig(
+            format='%(levelname)s: %(asctime)s: %(name)s: %(message)s',
+            level=logging.DEBUG if args.verbose else logging.WARNING,
+            datefmt='%m-%d-%Y %I:%M:%S %p')
+    log = logging.getLogger("monitor")
+    conf = conf_manager.parse(conf_manager.load(args.config))
+    general = conf.setdefault("general", {})
+    # Replay must not capture itself, write into production history or
+    # listen on the network
+    general.pop("capture_file", None)
+    general.pop("history_dir", None)
+    general.pop("api_port", None)
+    state = monitor.create_state(log, conf)
+    try:
+        report = replay(log, conf, state, args)
+    finally:
+        monitor.close_state(state)
+    print_report(report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Consistent hashing of targets onto testers"""
+
+import bisect
+import collections
+import hashlib
+import json
+import logging
+
+import framing
+
+log = logging.getLogger(__name__)
+
+def ring_point(key):
+    """Position of key on hash ring"""
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"),
+        digest_size=8).digest(), "big")
+
+class Ring:
+    """Hash ring with virtual nodes for every tester"""
+    def __init__(self, vnodes=64):
+        self.vnodes = vnodes
+        self.points = []
+        self.owners = {}
+
+    def add(self, name):
+        """Place tester on ring"""
+        for vnode in range(self.vnodes):
+            point = ring_point(f"{name}#{vnode}")
+            bisect.insort(self.points, point)
+            self.owners[point] = name
+
+    def remove(self, name):
+        """Take tester off ring"""
+        for vnode in range(self.vnodes):
+            point = ring_point(f"{name}#{vnode}")
+            if self.owners.pop(point, None) is not None:
+                del self.points[bisect.bisect_left(self.points, point)]
+
+    def lookup(self, key, count):
+        """First count distinct testers clockwise from key"""
+        found = []
+        if not self.points:
+            return found
+        start = bisect.bisect(self.points, ring_point(key))
+        for offset in range(len(self.points)):
+            owner = self.owners[self.points[(start + offset) %
+                len(self.points)]]
+            if owner not in found:
+                found.append(owner)
+                if len(found) == count:
+                    break
+        return found
+
+class Shards:
+    """Assignment of config targets to connected testers"""
+    def __init__(self, conf, replicas=2, vnodes=64):
+        self.general = conf.get("general", {})
+        self.targets = {name: subconf for name, subconf in conf.items()
+                if name != "general"}
+        self.replicas = replicas
+        self.ring = Ring(vnodes)
+        self.members = collections.Counter()
+        self.payloads = {}
+        # Targets of every tester, and those taken from testers still on ring
+        self.assigned = {}
+        self.released = {}
+        self.changed = False
+
+    def join(self, name):
+        """Register connected tester"""
+        self.members[name] += 1
+        if self.members[name] == 1:
+            log.info("Tester %s joined shard ring", name)
+            self.ring.add(name)
+            self.changed = True
+
+    def leave(self, name):
+        """Unregister disconnected tester"""
+        if not self.members[name]:
+            return
+        self.members[name] -= 1
+        if not self.members[name]:
+            log.info("Tester %s left shard ring", name)
+            del self.members[name]
+            self.ring.remove(name)
+            self.payloads.pop(name, None)
+            self.changed = True
+
+    def rebalance(self):
+        """Recompute assignments, return testers whose targets changed"""
+        assigned = {name: {} for name in self.members}
+        for target, subconf in self.targets.items():
+            for name in self.ring.lookup(target, self.replicas):
+                assigned[name][target] = subconf
+        moved = set()
+        for name, targets in assigned.items():
+            gone = self.assigned.get(name, set()) - targets.keys()
+            if gone:
+                self.released.setdefault(name, set()).update(gone)
+            payload = framing.ConfigPayload(
+                    json.dumps({"general": self.general} | targets) + "\n")
+            previous = self.payloads.get(name)
+            if previous is None or previous.plain != payload.plain:
+                log.debug("Tester %s now probes %s targets", name,
+                        len(targets))
+                self.payloads[name] = payload
+                moved.add(name)
+        self.assigned = {name: set(targets)
+                for name, targets in assigned.items()}
+        self.changed = False
+        return moved
+
+    def take_released(self):
+        """Return targets taken from testers since last call, by tester"""
+        released = {}
+        for name, targets in self.released.items():
+            targets -= self.assigned.get(name, set())
+            if targets and name in self.members:
+                released[name] = targets
+        self.released = {}
+        return released
+
+    def payload(self, name):
+        """Config with targets assigned to tester"""
+        if self.changed:
+            self.rebalance()
+        try:
+            return self.payloads[name]
+        except KeyError:
+            log.warning("Tester %s is not on shard ring, sending no targets",
+                    name)
+            return framing.ConfigPayload(
+                    json.dumps({"general": self.general}) + "\n")
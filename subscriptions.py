@@ -0,0 +1,137 @@
+"""Change feed pushed to subscribed connections"""
+
+import collections
+import json
+import logging
+
+log = logging.getLogger(__name__)
+
+MAX_QUEUE = 100000
+POLICIES = ("coalesce", "drop")
+
+def name_filter(filters, key):
+    """Set of names from list filter, None when not given"""
+    names = filters.get(key, [])
+    if not isinstance(names, list) or not all(isinstance(name, str)
+            for name in names):
+        raise ValueError(f"{key} must be a list of strings")
+    return set(names) or None
+
+class Subscriber:
+    """Bounded event queue of one subscribed connection"""
+    def __init__(self, sock, filters):
+        self.sock = sock
+        self.targets = name_filter(filters, "targets")
+        self.types = name_filter(filters, "types")
+        policy = filters.get("policy", "coalesce")
+        if policy not in POLICIES:
+            raise ValueError(f"policy must be one of {POLICIES}")
+        self.coalesce = policy == "coalesce"
+        self.max_queue = filters.get("queue", 1000)
+        if (not isinstance(self.max_queue, int) or
+                isinstance(self.max_queue, bool) or
+                not 1 <= self.max_queue <= MAX_QUEUE):
+            raise ValueError(f"queue must be integer from 1 to {MAX_QUEUE}")
+        # Coalescing keeps only newest event per key, in first queued order
+        self.queue = collections.OrderedDict()
+        self.sequence = 0
+        self.dropped = 0
+        self.out = b""
+        self.sent = 0
+
+    def wants(self, event):
+        """Check event against subscription filters"""
+        return ((self.types is None or event["type"] in self.types) and
+                (self.targets is None or event.get("target") in self.targets))
+
+    def push(self, event):
+        """Queue event, dropping oldest when queue is full"""
+        if self.coalesce:
+            key = (event["type"], event.get("target"), event.get("tester"))
+        else:
+            key = self.sequence
+            self.sequence += 1
+        if key in self.queue:
+            self.queue[key] = event
+            return
+        if len(self.queue) >= self.max_queue:
+            self.queue.popitem(last=False)
+            self.dropped += 1
+        self.queue[key] = event
+
+    def fill(self, max_events=256):
+        """Encode queued events into output buffer"""
+        lines = []
+        if self.dropped:
+            lines.append("EVENT:" + json.dumps({"type": "dropped",
+                "count": self.dropped}) + "\n")
+            self.dropped = 0
+        while self.queue and len(lines) < max_events:
+            _, event = self.queue.popitem(last=False)
+            lines.append("EVENT:" + json.dumps(event) + "\n")
+        self.out = "".join(lines).encode("ascii")
+        self.sent = 0
+
+    def has_data(self):
+        """Check if anything is waiting to be sent"""
+        return self.sent < len(self.out) or bool(self.queue) or bool(
+                self.dropped)
+
+    def send(self):
+        """Send as much as socket accepts, return False on error"""
+        while self.has_data():
+            if self.sent >= len(self.out):
+                self.fill()
+            try:
+                self.sent += self.sock.send(memoryview(self.out)[self.sent:])
+            except BlockingIOError:
+                return True
+            except OSError:
+                return False
+        return True
+
+class Hub:
+    """Registry of subscribers receiving published events"""
+    def __init__(self):
+        self.subscribers = {}
+        self.ready = set()
+
+    def subscribe(self, sock, request_value):
+        """Register connection as subscriber"""
+        filters = json.loads(request_value) if request_value else {}
+        if not isinstance(filters, dict):
+            raise ValueError("Subscription filters must be an object")
+        subscriber = Subscriber(sock, filters)
+        # Slow subscriber must never block the loop
+        sock.setblocking(False)
+        self.subscribers[sock] = subscriber
+        log.info("New subscriber %s", filters)
+        return subscriber
+
+    def unsubscribe(self, sock):
+        """Remove subscriber of connection"""
+        self.subscribers.pop(sock, None)
+        self.ready.discard(sock)
+
+    def publish(self, events):
+        """Queue events for every interested subscriber"""
+        for event in events:
+            for sock, subscriber in self.subscribers.items():
+                if subscriber.wants(event):
+                    subscriber.push(event)
+                    self.ready.add(sock)
+
+    def schedule(self, lists):
+        """Register subscribers with queued events for writing"""
+        for sock in self.ready:
+            if not sock in lists.write:
+                lists.write.append(sock)
+        self.ready.clear()
+
+    def process_write(self, sock, lists):
+        """Send queued events, return False if connection failed"""
+        subscriber = self.subscribers[sock]
+        alive = subscriber.send()
+        if not alive or not subscriber.has_data():
+            lists.write.remove(sock)
+        return alive
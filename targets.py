@@ -0,0 +1,217 @@
+"""Compact registry of probe targets kept in parallel columns"""
+
+import array
+import collections
+import random
+import logging
+import types
+
+import histogram
+import icmp
+import bpf
+
+log = logging.getLogger(__name__)
+
+KIND_ECHO = 0
+KIND_TIMESTAMP = 1
+KIND_HTTP = 2
+KIND_TCP = 3
+ICMP_KINDS = {"echo": KIND_ECHO, "timestamp": KIND_TIMESTAMP}
+REQUEST_TYPES = {KIND_ECHO: icmp.ECHO_REQUEST,
+        KIND_TIMESTAMP: icmp.TIMESTAMP_REQUEST}
+
+STATUS_PENDING = 0
+STATUS_OK = 1
+STATUS_FAILED = 2
+
+PRIORITY_CRITICAL = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+PRIORITIES = {"critical": PRIORITY_CRITICAL, "normal": PRIORITY_NORMAL,
+        "low": PRIORITY_LOW}
+
+class TargetTable:
+    """Targets and the probes they share, columns are indexed by id"""
+    def __init__(self, source):
+        self.source = icmp.address_to_int(source)
+        # Target columns
+        self.names = []
+        self.probe = array.array("I")
+        # Compiled regex of http targets checking page content
+        self.regex = {}
+        # Probe columns
+        self.kind = bytearray()
+        self.dest = array.array("I")
+        self.port = array.array("H")
+        self.ident = array.array("H")
+        self.seq = array.array("H")
+        self.sent = array.array("d")
+        self.rtt = array.array("d")
+        self.status = bytearray()
+        # Shared probe has priority of its most important target
+        self.priority = bytearray()
+        self.keys = {}
+        self.icmp_probes = array.array("I")
+        self.http = {}
+        self.http_probes = array.array("I")
+        self.tcp_probes = array.array("I")
+        # Identifiers of this table start at random offset
+        self.ident_base = random.randrange(0x10000)
+        self.lap = 0
+        self.socket = None
+        # Number of ICMP probes covered by filter on raw socket
+        self.filtered = 0
+        # Latency samples of interval as probe * BUCKETS + bucket index
+        self.latency = array.array("Q")
+
+    def __len__(self):
+        return len(self.names)
+
+    def add_probe(self, key, kind, dest=0, port=0):
+        """Create probe for key, return None if it already exists"""
+        if key in self.keys:
+            return None
+        probe = len(self.kind)
+        self.keys[key] = probe
+        self.kind.append(kind)
+        self.dest.append(dest)
+        self.port.append(port)
+        self.ident.append((self.ident_base + probe) & 0xffff)
+        self.seq.append(0)
+        self.sent.append(0)
+        self.rtt.append(-1)
+        self.status.append(STATUS_PENDING)
+        self.priority.append(PRIORITY_LOW)
+        return probe
+
+    def add_target(self, name, probe, priority):
+        """Register target checked by probe"""
+        self.names.append(name)
+        self.probe.append(probe)
+        self.priority[probe] = min(self.priority[probe], priority)
+        return len(self.names) - 1
+
+    def add_icmp(self, name, destination, query_type,
+            priority=PRIORITY_NORMAL):
+        """Add ICMP target, sharing probe with same destination and type"""
+        kind = ICMP_KINDS[query_type]
+        dest = icmp.address_to_int(destination)
+        key = ("icmp", dest, kind)
+        if self.add_probe(key, kind, dest) is not None:
+            self.icmp_probes.append(self.keys[key])
+            if not self.socket:
+                # Every ICMP probe shares one raw socket
+                self.socket = icmp.open_socket()
+        return self.add_target(name, self.keys[key], priority)
+
+    def add_http(self, name, url, method, regex, priority=PRIORITY_NORMAL):
+        """Add HTTP target, sharing fetch with same url and method"""
+        key = ("http", url, method)
+        probe = self.add_probe(key, KIND_HTTP)
+        if probe is not None:
+            self.http_probes.append(probe)
+            self.http[probe] = types.SimpleNamespace(url=url, method=method,
+                    targets=[], etag=None, last_modified=None, matches={})
+        probe = self.keys[key]
+        target = self.add_target(name, probe, priority)
+        self.http[probe].targets.append(target)
+        if regex is not None:
+            self.regex[target] = regex
+        return target
+
+    def add_tcp(self, name, destination, port, priority=PRIORITY_NORMAL):
+        """Add TCP target, sharing connect with same destination and port"""
+        dest = icmp.address_to_int(destination)
+        key = ("tcp", dest, port)
+        probe = self.add_probe(key, KIND_TCP, dest, port)
+        if probe is not None:
+            self.tcp_probes.append(probe)
+        return self.add_target(name, self.keys[key], priority)
+
+    def start_lap(self):
+        """Reset probe status before new lap"""
+        self.lap = (self.lap + 1) & 0xff
+        self.status[:] = bytes(len(self.status))
+
+    def update_filter(self):
+        """Attach filter for identifiers of current ICMP probes, kernel then
+        drops unrelated ICMP traffic before it wakes tester"""
+        if not self.socket or self.filtered == len(self.icmp_probes):
+            return
+        first = self.icmp_probes[0]
+        count = self.icmp_probes[-1] - first + 1
+        try:
+            bpf.attach(self.socket, icmp.reply_filter(
+                (self.ident_base + first) & 0xffff, count))
+        except (OSError, ValueError) as error:
+            log.warning("Cannot filter icmp socket: %s", error)
+        self.filtered = len(self.icmp_probes)
+
+    def icmp_request(self, probe):
+        """Build IP packet with ICMP request of probe"""
+        # High byte of sequence extends identifier past 16 bits
+        self.seq[probe] = ((probe >> 16) & 0xff) << 8 | self.lap
+        payload = icmp.pack_request(REQUEST_TYPES[self.kind[probe]],
+                self.ident[probe], self.seq[probe])
+        return icmp.pack_ip_header(self.source, self.dest[probe],
+                len(payload)) + payload
+
+    def match_reply(self, icmp_type, identifier, sequence):
+        """Find probe of reply, None if reply does not belong to table"""
+        probe = ((sequence >> 8) << 16) | (
+                (identifier - self.ident_base) & 0xffff)
+        if probe >= len(self.kind) or self.kind[probe] not in REQUEST_TYPES:
+            return None
+        if self.seq[probe] != sequence or self.ident[probe] != identifier:
+            return None
+        expected = icmp.REPLY_TYPES[REQUEST_TYPES[self.kind[probe]]]
+        if icmp_type != expected and icmp_type not in icmp.ERROR_TYPES:
+            return None
+        return probe
+
+    def finish(self, probe, status, rtt=-1):
+        """Store result of probe"""
+        self.status[probe] = status
+        self.rtt[probe] = rtt
+        if status == STATUS_OK and rtt >= 0:
+            self.latency.append(probe * histogram.BUCKETS +
+                    histogram.bucket_index(rtt))
+
+    def results(self):
+        """Results of last lap keyed by target name, probes that did not
+        run in lap are left out"""
+        stats = {}
+        for target, name in enumerate(self.names):
+            probe = self.probe[target]
+            if self.status[probe] == STATUS_PENDING:
+                continue
+            if self.kind[probe] == KIND_HTTP:
+                stats[name] = self.status[probe] == STATUS_OK and (
+                        target not in self.regex or
+                        self.http[probe].matches.get(target, False))
+            elif self.status[probe] == STATUS_OK:
+                stats[name] = self.rtt[probe]
+            else:
+                stats[name] = -1
+        return stats
+
+    def histograms(self):
+        """Encode latency samples of interval per target and reset them"""
+        counts = collections.Counter(self.latency)
+        self.latency = array.array("Q")
+        pairs = {}
+        for sample, count in sorted(counts.items()):
+            probe, index = divmod(sample, histogram.BUCKETS)
+            pairs.setdefault(probe, []).append((index, count))
+        # Probe histogram is encoded once and shared by its targets
+        encoded = {probe: histogram.encode(probe_pairs)
+                for probe, probe_pairs in pairs.items()}
+        return {name: encoded[self.probe[target]]
+                for target, name in enumerate(self.names)
+                if self.probe[target] in encoded}
+
+    def close(self):
+        """Close raw socket"""
+        if self.socket:
+            self.socket.close()
+            self.socket = None
@@ -8,14 +8,22 @@ import json
 import types
 import select
 import time
+import os
+import errno
+import struct
 import collections
 import concurrent.futures
 import urllib.request
 import re
+import zlib
 
 import helpers
+import conf_manager
 import timer
 import icmp
+import framing
+import targets
+import overload
 
 def connect_to_monitor(log, host, port):
     """Function to make connection to monitor"""
@@ -43,37 +51,38 @@ def connect_to_monitor(log, host, port):
         return None
     return mon_sock
 
-def recieve_data(log, sock):
-    """Recieve data from socket"""
+def recieve_data(log, sock, reader):
+    """Recieve next frame from socket"""
     address = sock.getpeername()
-    recieved_data = b""
     elapsed_timer = timer.Timer()
     elapsed_timer.start()
     timeout = 20
     log.debug("Waiting for response")
-    while True:
+    while not reader.frames:
         try:
-            recieved_data += sock.recv(4096)
+            recieved = reader.recv(sock)
+        except ValueError as error:
+            log.error("Invalid response from %s: %s", address, error)
+            sock.close()
+            return ""
         except OSError:
             log.warning("Error reading response from %s", address)
         else:
-            if not recieved_data:
+            if not recieved:
                 log.debug("Monitor %s closed connection", address)
                 sock.close()
                 return ""
-            log.debug("Recieved data %s", recieved_data)
-            if "\n".encode("ascii") in recieved_data:
-                log.debug("Data is recieved")
-                break
+            log.debug("Recieved %s bytes", recieved)
         log.debug("Elapsed time %s", elapsed_timer.time())
-        if elapsed_timer.time() >= timeout:
+        if not reader.frames and elapsed_timer.time() >= timeout:
             log.error("Request to monitor %s timeouted", address)
             sock.close()
             return ""
-    return recieved_data.decode("ascii")
+    log.debug("Data is recieved")
+    return reader.frames.popleft()
 
 
-def get_config(log, name, host, port):
+def get_config(log, name, host, port, reader):
     """Get config string from monitor"""
     log.debug("Getting config from %s:%s", host, port)
     mon_sock = None
@@ -87,15 +96,23 @@ def get_config(log, name, host, port):
                     wait_time)
             time.sleep(wait_time)
             continue
-    data = f"NAME:{name}\nCONFIG_REQUEST:\n".encode("ascii")
+    data = f"NAME:{name}\nCONFIG_REQUEST:zlib\n".encode("ascii")
     log.debug("Data to be send %s", data)
     mon_sock.sendall(data)
     log.debug("Data is sent")
-    response = recieve_data(log, mon_sock)
+    response = recieve_data(log, mon_sock, reader)
     return (mon_sock, response)
 
-def create_icmp(log, conf, name, source):
-    """Create object for icmp target"""
+def target_priority(log, conf, name):
+    """Priority of target from its config"""
+    priority = conf.get("priority", "normal")
+    if priority not in targets.PRIORITIES:
+        log.error("Invalid priority %s for %s, using normal", priority, name)
+        priority = "normal"
+    return targets.PRIORITIES[priority]
+
+def create_icmp(log, conf, name, table):
+    """Add icmp target to table, sharing probe with same destination"""
     log.debug("Found %s with proto icmp", name)
     query_type = conf.get("type", "echo")
     log.debug("Choosen query type %s", query_type)
@@ -103,28 +120,72 @@ def create_icmp(log, conf, name, source):
         destination = conf["dest"]
     except KeyError:
         log.error("Destination is not defined for %s. skipping", name)
-        return None
-    icmp_obj = types.SimpleNamespace(name=name, icmp=None)
-    if query_type == "echo":
-        icmp_obj.icmp = icmp.Echo(destination, source)
-    elif query_type == "timestamp":
-        icmp_obj.icmp = icmp.Timestamp(destination, source)
-    else:
+        return
+    if query_type not in targets.ICMP_KINDS:
         log.error("Invalid icmp type %s in %s", query_type, name)
-        return None
-    log.debug("Created icmp %s", icmp_obj)
-    return icmp_obj
+        return
+    try:
+        table.add_icmp(name, destination, query_type,
+                target_priority(log, conf, name))
+    except OSError:
+        log.error("Invalid destination %s in %s", destination, name)
+
+def create_tcp(log, conf, name, table):
+    """Add tcp target to table, sharing connect with same address"""
+    log.debug("Found %s with proto tcp", name)
+    try:
+        destination = conf["dest"]
+        port = int(conf["port"])
+    except KeyError:
+        log.error("Destination or port is not defined for %s. skipping",
+                name)
+        return
+    except ValueError:
+        log.error("Invalid port %s in %s", conf["port"], name)
+        return
+    if not 0 < port < 65536:
+        log.error("Invalid port %s in %s", port, name)
+        return
+    try:
+        table.add_tcp(name, destination, port,
+                target_priority(log, conf, name))
+    except OSError:
+        log.error("Invalid destination %s in %s", destination, name)
+
+def create_http(log, conf, name, table):
+    """Add http target to table, sharing fetch with same url"""
+    log.debug("Found http %s", name)
+    try:
+        url = conf["url"]
+    except KeyError:
+        log.error("No url for %s", name)
+        return
+    method = conf.get("method", "get").upper()
+    if method not in ("GET", "HEAD"):
+        log.error("Invalid method %s for %s", method, name)
+        return
+    regex = None
+    if method == "GET":
+        try:
+            regex = re.compile(conf["regex"])
+        except KeyError:
+            log.error("No regex for %s", name)
+            return
+        except re.error as error:
+            log.error("Invalid regex for %s: %s", name, error)
+            return
+    # Every check of same url is evaluated on one fetch
+    table.add_http(name, url, method, regex,
+            target_priority(log, conf, name))
 
 def populate_objs(log, conf):
-    """Create objects for targets from config"""
+    """Create target table from config"""
     source_ip = socket.gethostbyname(socket.gethostname())
     try:
         source_ip = conf["general"]["ip"]
     except KeyError:
         log.warning("Source ip is not defined, using %s", source_ip)
-    icmp_objs = {}
-    http = collections.namedtuple("HTTP", "name url regex")
-    http_objs = [ ]
+    table = targets.TargetTable(source_ip)
     for name, subconf in conf.items():
         if not name == "general":
             log.debug("Found %s with conf \n%s\n", name, subconf)
@@ -134,112 +195,379 @@ def populate_objs(log, conf):
                 log.error("Proto field not found for %s def", name)
             else:
                 if proto == "icmp":
-                    obj = create_icmp(log, subconf, name, source_ip)
-                    if obj:
-                        icmp_objs[obj.icmp.get_scoket()] = obj
+                    create_icmp(log, subconf, name, table)
+                elif proto == "tcp":
+                    create_tcp(log, subconf, name, table)
                 elif proto in ("http", "https"):
-                    log.debug("Found http %s", name)
-                    try:
-                        url = subconf["url"]
-                    except KeyError:
-                        log.error("No url for %s", name)
-                        continue
-                    try:
-                        regex = subconf["regex"]
-                    except KeyError:
-                        log.error("No regex for %s", name)
-                        continue
-                    http_objs.append(http(name, url, regex))
-    log.debug("Populated: %s %s", icmp_objs, http_objs)
-    return icmp_objs, http_objs
+                    create_http(log, subconf, name, table)
+    log.info("%s icmp probes, %s tcp probes and %s urls for %s targets",
+            len(table.icmp_probes), len(table.tcp_probes),
+            len(table.http_probes), len(table))
+    return table
 
-def send_icmp(log, icmp_objs, timeout):
-    """Make icmp requests and return results"""
-    r_list = [ ]
-    w_list = [ ]
-    stats = {}
-    elapsed_time = timer.Timer()
-    for sock, val in icmp_objs.items():
-        log.debug("Sending request to %s", val.name)
-        val.icmp.send()
-        r_list.append(sock)
+def send_icmp(log, table, probes, timeout):
+    """Send icmp requests of probes and wait for replies"""
+    sock = table.socket
+    if not sock or not probes:
+        return
+    table.update_filter()
+    pending = 0
+    for probe in probes:
+        packet = table.icmp_request(probe)
+        address = icmp.int_to_address(table.dest[probe])
+        while True:
+            try:
+                sock.sendto(packet, (address, 0))
+            except BlockingIOError:
+                select.select([], [sock], [], timeout)
+                continue
+            except OSError as error:
+                log.warning("Error sending icmp to %s: %s", address, error)
+                table.finish(probe, targets.STATUS_FAILED)
+            else:
+                table.sent[probe] = time.perf_counter()
+                pending += 1
+            break
     log.debug("All requests are sent")
+    elapsed_time = timer.Timer()
     elapsed_time.start()
-    while True:
-        log.debug("Lists %s %s", r_list, w_list)
-        read_ready, _, _ = select.select(r_list, w_list, [], timeout)
-        for sock in read_ready:
-            obj = icmp_objs[sock]
-            log.debug("%s ready for read", obj.name)
-            obj.icmp.recieve()
-            if obj.icmp.is_response_ready():
-                log.debug("%s response is read", obj.name)
-                if obj.icmp.reply_good():
-                    response = obj.icmp.get_response()
-                    stats[obj.name] = response["time"]
+    while pending and elapsed_time.time() < timeout:
+        if not select.select([sock], [], [],
+                timeout - elapsed_time.time())[0]:
+            continue
+        while True:
+            try:
+                packet = sock.recv(256)
+            except BlockingIOError:
+                break
+            except OSError as error:
+                log.warning("Error while reading response: %s", error)
+                break
+            received = time.perf_counter()
+            reply = icmp.parse_reply(packet)
+            if not reply:
+                continue
+            probe = table.match_reply(*reply)
+            if probe is None or table.status[probe] != targets.STATUS_PENDING:
+                continue
+            if reply[0] in icmp.ERROR_TYPES:
+                table.finish(probe, targets.STATUS_FAILED)
+            else:
+                table.finish(probe, targets.STATUS_OK,
+                        received - table.sent[probe])
+            pending -= 1
+    for probe in probes:
+        if table.status[probe] == targets.STATUS_PENDING:
+            table.finish(probe, targets.STATUS_FAILED)
+
+def connect_tcp(log, table, probe, epoll, connecting):
+    """Start non-blocking connect of probe, return socket file number if
+    connect is in progress"""
+    address = (icmp.int_to_address(table.dest[probe]), table.port[probe])
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setblocking(False)
+    # Close resets connection, so probes leave no TIME_WAIT behind
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+            struct.pack("ii", 1, 0))
+    table.sent[probe] = time.perf_counter()
+    error = sock.connect_ex(address)
+    if error == errno.EINPROGRESS:
+        epoll.register(sock.fileno(), select.EPOLLOUT)
+        connecting[sock.fileno()] = (sock, probe)
+        return sock.fileno()
+    if error:
+        log.debug("Connect to %s:%s failed: %s", *address,
+                os.strerror(error))
+        table.finish(probe, targets.STATUS_FAILED)
+    else:
+        table.finish(probe, targets.STATUS_OK,
+                time.perf_counter() - table.sent[probe])
+    sock.close()
+    return None
+
+def finish_tcp(table, fileno, epoll, connecting, status):
+    """Stop waiting for connect, store its result and close socket"""
+    sock, probe = connecting.pop(fileno)
+    epoll.unregister(fileno)
+    if status == targets.STATUS_OK:
+        table.finish(probe, status, time.perf_counter() - table.sent[probe])
+    else:
+        table.finish(probe, status)
+    sock.close()
+
+def send_tcp(log, table, probes, timeout, concurrency=1000):
+    """Connect to tcp probes, at most concurrency at once, timing
+    handshakes"""
+    if not probes:
+        return
+    epoll = select.epoll()
+    connecting = {}
+    # Connects in start order are also in timeout order
+    started = collections.deque()
+    next_probe = 0
+    try:
+        while next_probe < len(probes) or connecting:
+            while next_probe < len(probes) and len(connecting) < concurrency:
+                probe = probes[next_probe]
+                next_probe += 1
+                try:
+                    fileno = connect_tcp(log, table, probe, epoll,
+                            connecting)
+                except OSError as error:
+                    log.error("Cannot start tcp probe: %s", error)
+                    table.finish(probe, targets.STATUS_FAILED)
+                    continue
+                if fileno is not None:
+                    started.append((probe, fileno))
+            while started and (started[0][1] not in connecting or
+                    connecting[started[0][1]][1] != started[0][0]):
+                started.popleft()
+            if not started:
+                continue
+            wait = table.sent[started[0][0]] + timeout - time.perf_counter()
+            for fileno, _ in epoll.poll(max(wait, 0), len(connecting)):
+                sock = connecting[fileno][0]
+                if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR):
+                    finish_tcp(table, fileno, epoll, connecting,
+                            targets.STATUS_FAILED)
                 else:
-                    stats[obj.name] = -1
-                r_list.remove(sock)
-        if not r_list:
-            break
-        if not read_ready and elapsed_time.time() > timeout:
-            for sock in r_list:
-                stats[icmp_objs[sock].name] = -1
-            break
-    return stats
+                    finish_tcp(table, fileno, epoll, connecting,
+                            targets.STATUS_OK)
+            now = time.perf_counter()
+            while started and table.sent[started[0][0]] + timeout <= now:
+                probe, fileno = started.popleft()
+                if fileno in connecting and connecting[fileno][1] == probe:
+                    finish_tcp(table, fileno, epoll, connecting,
+                            targets.STATUS_FAILED)
+    finally:
+        for sock, _ in connecting.values():
+            sock.close()
+        epoll.close()
 
-def load_http(log, url, timeout):
-    """Send http request and load response"""
+def load_http(log, url, timeout, method="GET", headers=None):
+    """Send http request and load response unless it is not modified"""
     http_handler = urllib.request.HTTPHandler()
     https_handler = urllib.request.HTTPSHandler()
     opener = urllib.request.build_opener(http_handler, https_handler)
-    with opener.open(url, timeout=timeout) as conn:
-        log.debug("Sending HTTP request to %s", url)
-        data = conn.read().decode('utf-8')
-        return data
+    request = urllib.request.Request(url, method=method,
+            headers=headers or {})
+    elapsed_timer = timer.Timer()
+    elapsed_timer.start()
+    response = types.SimpleNamespace(data=None, modified=True, etag=None,
+            last_modified=None, time=None)
+    try:
+        with opener.open(request, timeout=timeout) as conn:
+            log.debug("Sending HTTP %s request to %s", method, url)
+            response.etag = conn.headers.get("ETag")
+            response.last_modified = conn.headers.get("Last-Modified")
+            if method == "GET":
+                response.data = conn.read().decode('utf-8')
+    except urllib.error.HTTPError as err:
+        if err.code != 304:
+            raise
+        log.debug("%s is not modified", url)
+        response.modified = False
+    response.time = elapsed_timer.time()
+    return response
 
-def send_http(log, http_objs, timeout):
-    """Make http requests to targets"""
-    stats = {}
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-        futures_http = {executor.submit(
-            load_http, log, http.url, timeout): http for http in http_objs}
-        for future in concurrent.futures.as_completed(futures_http):
-            http = futures_http[future]
-            try:
-                data = future.result()
-            except urllib.error.URLError as err:
-                log.error("Error loading %s, reason", http.url, err)
-                stats[http.name] = False
-            else:
-                log.debug("Searching for %s", http.regex)
-                if re.search(http.regex, data):
-                    stats[http.name] = True
-                else:
-                    stats[http.name] = False
-    return stats
+def validators(table, http):
+    """Conditional request headers if every check has a cached result"""
+    if http.method != "GET" or any(target not in http.matches
+            for target in http.targets if target in table.regex):
+        return {}
+    headers = {}
+    if http.etag:
+        headers["If-None-Match"] = http.etag
+    if http.last_modified:
+        headers["If-Modified-Since"] = http.last_modified
+    return headers
+
+def check_http(log, table, probe, response):
+    """Evaluate checks of url on response, reusing results if unchanged"""
+    http = table.http[probe]
+    if response.modified:
+        http.etag = response.etag
+        http.last_modified = response.last_modified
+        http.matches = {}
+        for target in http.targets:
+            regex = table.regex.get(target)
+            if regex:
+                log.debug("Searching for %s", regex.pattern)
+                http.matches[target] = bool(regex.search(response.data))
+    table.finish(probe, targets.STATUS_OK, response.time)
+
+def finish_http(log, table, probe, future):
+    """Store result of completed http request"""
+    try:
+        response = future.result()
+    except OSError as err:
+        # Timeouts cut short by budget are not wrapped in URLError
+        log.error("Error loading %s, reason %s", table.http[probe].url, err)
+        table.finish(probe, targets.STATUS_FAILED)
+    else:
+        check_http(log, table, probe, response)
+
+def send_http(log, executor, table, probes, timeout, workers=5, budget=None):
+    """Make http requests of probes, at most workers at once, those not
+    done within budget are left out of lap"""
+    elapsed_time = timer.Timer()
+    elapsed_time.start()
+    running = {}
+    next_probe = 0
+    while next_probe < len(probes) or running:
+        remaining = None if budget is None else budget - elapsed_time.time()
+        while (next_probe < len(probes) and len(running) < workers and
+                (remaining is None or remaining > 0)):
+            probe = probes[next_probe]
+            next_probe += 1
+            http = table.http[probe]
+            # Request must not outlive budget, executor is shared by laps
+            running[executor.submit(load_http, log, http.url,
+                timeout if remaining is None else min(timeout, remaining),
+                http.method, validators(table, http))] = probe
+        if not running:
+            break
+        done = concurrent.futures.wait(running, remaining,
+                concurrent.futures.FIRST_COMPLETED)[0]
+        if not done:
+            break
+        for future in done:
+            finish_http(log, table, running.pop(future), future)
+    if running or next_probe < len(probes):
+        log.warning("%s http probes did not finish within lap budget",
+                len(running) + len(probes) - next_probe)
+
+def run_probes(log, table, controller, lap_timer, executor):
+    """Run probes selected for lap, critical ones first when limited"""
+    critical, others = controller.select(table, table.icmp_probes)
+    send_icmp(log, table, critical + others, 5)
+    critical, others = controller.select(table, table.tcp_probes)
+    send_tcp(log, table, critical + others, 5, controller.tcp_concurrency)
+    critical, others = controller.select(table, table.http_probes)
+    if not controller.limited():
+        send_http(log, executor, table, critical + others, 10,
+                controller.workers)
+        return
+    send_http(log, executor, table, critical, 10, controller.workers)
+    # Other probes only get what is left of lap
+    budget = controller.lap_time - lap_timer.time()
+    send_http(log, executor, table, others, 10, controller.other_workers(),
+            max(budget, 0))
+
+def send_to_monitor(log, monitor_data, message):
+    """Send message to monitor, reconnecting if connection is lost"""
+    try:
+        if not monitor_data.socket:
+            raise ConnectionError("Not connected")
+        monitor_data.socket.sendall(message.encode("ascii"))
+        return
+    except OSError:
+        log.error("Cannot send data to monitor, reconnecting")
+    monitor_data.socket = connect_to_monitor(log,
+            monitor_data.host, monitor_data.port)
+    monitor_data.reader = framing.FrameReader()
+    if monitor_data.socket:
+        # Monitor needs name to assign targets to new connection
+        try:
+            monitor_data.socket.sendall(
+                    f"NAME:{monitor_data.name}\nCONFIG_REQUEST:zlib\n"
+                    .encode("ascii"))
+        except OSError:
+            log.error("Cannot send name to monitor")
+
+def check_config(log, monitor_data):
+    """Return config pushed by monitor since last check if any"""
+    sock = monitor_data.socket
+    if not sock:
+        return None
+    try:
+        while select.select([sock], [], [], 0)[0]:
+            if not monitor_data.reader.recv(sock):
+                log.error("Monitor closed connection")
+                sock.close()
+                monitor_data.socket = None
+                break
+    except (OSError, ValueError) as error:
+        log.error("Error reading from monitor: %s", error)
+        return None
+    remote_conf = None
+    while monitor_data.reader.frames:
+        raw_conf = monitor_data.reader.frames.popleft()
+        try:
+            remote_conf = json.loads(framing.decode_config(raw_conf))
+        except (ValueError, zlib.error):
+            log.error("Error parsing pushed config, config: \n%s\n",
+                    raw_conf)
+    return remote_conf
+
+def send_histograms(log, monitor_data, table):
+    """Send latency histograms collected since last send and reset them"""
+    encoded = table.histograms()
+    log.debug("Sending histograms of %s targets", len(encoded))
+    send_to_monitor(log, monitor_data,
+            "HISTOGRAM_UPDATE:" + json.dumps(encoded) + "\n")
+
+def create_controller(log, conf):
+    """Create overload controller with configured policy"""
+    policy = conf_manager.option(conf, "overload_policy", "none")
+    if policy not in overload.POLICIES:
+        log.error("Invalid overload policy %s, using none", policy)
+        policy = "none"
+    return overload.Controller(policy,
+            conf_manager.option(conf, "lap_time", 10, float),
+            conf_manager.option(conf, "http_workers", 5, int),
+            conf_manager.option(conf, "tcp_concurrency", 1000, int))
+
+def report_overload(log, monitor_data, controller):
+    """Tell monitor about overload while it lasts and when it ends"""
+    if controller.level or controller.changed:
+        send_to_monitor(log, monitor_data,
+                "OVERLOAD:" + json.dumps(controller.report()) + "\n")
 
 def run_loop(log, conf, monitor_data):
     """Main tester loop"""
-    icmp_objs, http_objs = populate_objs(log, conf)
+    table = populate_objs(log, conf)
     elapsed_time = timer.Timer()
-    expected_lap_time = 10
+    controller = create_controller(log, conf)
+    # Requests left running by a lap keep their worker, so http
+    # concurrency stays bounded across laps
+    workers = controller.workers
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    histogram_timer = timer.Timer()
+    histogram_timer.start()
+    histogram_interval = conf_manager.option(conf, "histogram_interval", 60,
+            float)
     while True:
         elapsed_time.start()
-        stats = {}
-        stats = stats | send_icmp(log, icmp_objs, 5)
-        stats = stats | send_http(log, http_objs, 10)
+        remote_conf = check_config(log, monitor_data)
+        if remote_conf is not None:
+            conf = remote_conf | monitor_data.local_conf
+            log.info("Monitor pushed new config")
+            log.debug("Merged config: \n%s\n", helpers.to_json(conf))
+            table.close()
+            table = populate_objs(log, conf)
+            controller = create_controller(log, conf)
+            if controller.workers != workers:
+                executor.shutdown(wait=False)
+                workers = controller.workers
+                executor = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=workers)
+        table.start_lap()
+        controller.start_lap()
+        run_probes(log, table, controller, elapsed_time, executor)
+        stats = table.results()
         log.debug("Lap finished")
         log.debug("Stats: \n%s\n", helpers.to_json(stats))
-        try:
-            monitor_data.socket.sendall(str("STATS_UPDATE:" +
-                    json.dumps(stats) + "\n").encode("ascii"))
-        except OSError:
-            log.error("Cannot send stats to monitor, reconnecting")
-            monitor_data.socket = connect_to_monitor(log,
-                    monitor_data.host, monitor_data.port)
+        send_to_monitor(log, monitor_data,
+                "STATS_UPDATE:" + json.dumps(stats) + "\n")
+        if histogram_timer.time() >= histogram_interval:
+            send_histograms(log, monitor_data, table)
+            histogram_timer.stop()
+            histogram_timer.start()
         log.debug("Lap time %s", elapsed_time.time())
-        remaining_time = expected_lap_time - elapsed_time.time()
+        controller.finish_lap(elapsed_time.time())
+        report_overload(log, monitor_data, controller)
+        remaining_time = controller.lap_time - elapsed_time.time()
         log.debug("Sleeping for %s", remaining_time)
         if remaining_time > 0:
             time.sleep(remaining_time)
@@ -256,8 +584,9 @@ def start(conf):
         log.warning("Name is not defined, using random name: %s", name)
     monitor_host_default = "localhost"
     monitor_port_default = 5000
-    monitor_data = types.SimpleNamespace(socket=None,
-            host=monitor_host_default, port=monitor_port_default)
+    monitor_data = types.SimpleNamespace(socket=None, name=name,
+            host=monitor_host_default, port=monitor_port_default,
+            reader=framing.FrameReader(), local_conf=conf)
     try:
         monitor_data.host, monitor_data.port = conf["general"][
                 "monitor"].split(":")
@@ -275,11 +604,11 @@ def start(conf):
         monitor_data.port = monitor_port_default
 
     monitor_data.socket, raw_conf = get_config(log, name, monitor_data.host,
-            monitor_data.port)
+            monitor_data.port, monitor_data.reader)
     remote_conf = {}
     try:
-        remote_conf = json.loads(raw_conf)
-    except json.JSONDecodeError:
+        remote_conf = json.loads(framing.decode_config(raw_conf))
+    except (ValueError, zlib.error):
         log.error("Error parsing remote config, config: \n%s\n", raw_conf)
     conf = remote_conf | conf
     log.debug("Merged config: \n%s\n", helpers.to_json(conf))
@@ -0,0 +1,15 @@
+"""Batches between ingest workers and aggregator"""
+
+import types
+
+import channel
+
+def test_long_names_survive_batch():
+    sent = []
+    forwarder = channel.Forwarder(types.SimpleNamespace(
+        send_bytes=sent.append))
+    tester, target = "t" * 70000, "x" * 100000
+    forwarder.add(1.0, tester, {target: 0.5})
+    forwarder.flush()
+    assert list(channel.Receiver().decode(sent[0])) == [
+            ("stats", 1.0, tester, {target: 0.5})]
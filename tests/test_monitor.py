@@ -0,0 +1,142 @@
+"""Monitor loop driven through real tester connections"""
+
+import json
+import logging
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+import framing
+import monitor
+
+log = logging.getLogger(__name__)
+
+def start_monitor(general, targets):
+    """Run monitor loop in background thread, return its port"""
+    conf = {"general": {"ip": "127.0.0.1", "port": "0"} | general} | targets
+    state = monitor.create_state(log, conf)
+    server_socket = monitor.listen_socket(log, conf)
+    threading.Thread(target=monitor.testers_loop,
+            args=(server_socket, conf, log, state), daemon=True).start()
+    return server_socket.getsockname()[1], state
+
+def connect(port, data):
+    """Connect to monitor and send data"""
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.settimeout(5)
+    sock.sendall(data)
+    return sock, framing.FrameReader()
+
+def read_config(sock, reader):
+    """Wait for next config frame"""
+    while not reader.frames:
+        if not reader.recv(sock):
+            raise ConnectionError("Monitor closed connection")
+    return json.loads(framing.decode_config(reader.frames.popleft()))
+
+def test_joining_tester_moves_targets_off_existing_one():
+    targets = {f"target{index}": {"proto": "icmp", "dest": "127.0.0.1"}
+            for index in range(200)}
+    port, _ = start_monitor({"shard": "yes", "shard_replicas": "1"},
+            targets)
+    first, first_reader = connect(port, b"NAME:a\nCONFIG_REQUEST:\n")
+    assert len(read_config(first, first_reader)) == 201
+    second, second_reader = connect(port, b"NAME:b\nCONFIG_REQUEST:\n")
+    second_targets = set(read_config(second, second_reader)) - {"general"}
+    first_targets = set(read_config(first, first_reader)) - {"general"}
+    assert first_targets and second_targets
+    assert first_targets | second_targets == set(targets)
+    assert not first_targets & second_targets
+
+def test_invalid_subscription_closes_only_that_connection():
+    port, _ = start_monitor({"consensus_quorum": "1"}, {})
+    for filters in ('{"queue":0}', '{"queue":null}', '{"targets":5}',
+            '{"types":[1]}', '{"policy":"x"}', '[]', 'nope'):
+        sock, _ = connect(port, f"SUBSCRIBE:{filters}\n".encode("ascii"))
+        assert sock.recv(1) == b""
+    subscriber, _ = connect(port, b'SUBSCRIBE:{"queue":1}\n')
+    tester, _ = connect(port, b'NAME:a\nSTATS_UPDATE:{"x": 0.1}\n')
+    assert subscriber.recv(4096).startswith(b"EVENT:")
+
+def test_malformed_histograms_are_ignored():
+    port, state = start_monitor({}, {})
+    tester, reader = connect(port, b'NAME:a\nHISTOGRAM_UPDATE:{"x":5}\n'
+            b'HISTOGRAM_UPDATE:{"x":null}\nHISTOGRAM_UPDATE:[1]\n'
+            b'HISTOGRAM_UPDATE:{"x":"AQ=="}\nHISTOGRAM_UPDATE:{"x":"AQAC"}\n'
+            b'CONFIG_REQUEST:\n')
+    assert read_config(tester, reader) == {"general": {"ip": "127.0.0.1",
+        "port": "0"}}
+    assert state.aggregates.buckets == {}
+
+def test_out_of_range_overload_reports_are_ignored():
+    port, state = start_monitor({}, {})
+    reports = "".join(f"OVERLOAD:{report}\n" for report in (
+        '{"level":-1,"overrun":0,"skipped":0}',
+        '{"level":70000,"overrun":0,"skipped":0}',
+        '{"level":1,"overrun":-1,"skipped":0}',
+        '{"level":1,"overrun":1e400,"skipped":0}',
+        '{"level":1,"overrun":0,"skipped":-1}',
+        '{"level":1,"overrun":0,"skipped":4294967296}',
+        '{"level":1e400,"overrun":0,"skipped":0}'))
+    tester, reader = connect(port, f"NAME:a\n{reports}CONFIG_REQUEST:\n"
+            .encode("ascii"))
+    read_config(tester, reader)
+    assert not state.metrics.testers
+    tester.sendall(b'OVERLOAD:{"level":2,"overrun":0.5,"skipped":3}\n'
+            b'CONFIG_REQUEST:\n')
+    read_config(tester, reader)
+    assert "a" in state.metrics.testers
+
+def test_out_of_range_times_are_rejected(tmp_path):
+    port, state = start_monitor({"api_port": "0",
+        "history_dir": str(tmp_path)}, {})
+    tester, reader = connect(port, b'NAME:a\nSTATS_UPDATE:{"x": 0.1}\n'
+            b'CONFIG_REQUEST:\n')
+    read_config(tester, reader)
+    api_port = state.api.socket.getsockname()[1]
+    for path in ("/range?end=1e20", "/range?start=-1e20",
+            "/aggregate?end=inf", "/aggregate?end=1e400&target=x",
+            "/aggregate?start=nan"):
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"http://127.0.0.1:{api_port}{path}",
+                    timeout=5)
+        assert error.value.code == 400
+    with urllib.request.urlopen(f"http://127.0.0.1:{api_port}/aggregate"
+            "?target=x", timeout=5) as response:
+        assert json.load(response)["x"]
+
+def test_targets_moved_off_tester_are_forgotten():
+    targets = {f"target{index}": {"proto": "icmp", "dest": "127.0.0.1"}
+            for index in range(200)}
+    port, state = start_monitor({"shard": "yes", "shard_replicas": "1",
+        "consensus_quorum": "1", "metrics_interval": "0"}, targets)
+    first, first_reader = connect(port, b"NAME:a\nCONFIG_REQUEST:\n")
+    read_config(first, first_reader)
+    first.sendall(b"STATS_UPDATE:" + json.dumps(dict.fromkeys(targets, 0.1))
+            .encode("ascii") + b"\nCONFIG_REQUEST:\n")
+    read_config(first, first_reader)
+    second, second_reader = connect(port, b"NAME:b\nCONFIG_REQUEST:\n")
+    moved = set(read_config(second, second_reader)) - {"general"}
+    kept = set(read_config(first, first_reader)) - {"general"}
+    assert set(state.stats["a"]) == kept
+    assert {target for target, testers in state.aggregates.latest.items()
+            if "a" in testers} == kept
+    assert all("a" not in state.consensus.targets[target].reports
+            for target in moved)
+    body = state.metrics.payload().decode("utf-8")
+    assert all(f'tester="a",target="{target}"' not in body
+            for target in moved)
+    assert all(f'tester="a",target="{target}"' in body for target in kept)
+
+def test_malformed_stats_are_ignored():
+    port, state = start_monitor({"consensus_quorum": "1"}, {})
+    tester, reader = connect(port, b'NAME:a\nSTATS_UPDATE:[1]\n'
+            b'STATS_UPDATE:5\nSTATS_UPDATE:null\nSTATS_UPDATE:"x"\n'
+            b'STATS_UPDATE:{"x":[1],"y":{"z":1},"w":null}\n'
+            b'CONFIG_REQUEST:\n')
+    read_config(tester, reader)
+    assert set(state.stats["a"]) == {"x", "y", "w"}
@@ -0,0 +1,22 @@
+"""Replay of captured traffic through monitor loop"""
+
+import capture
+import replay
+
+def test_replay_goes_through_loop_without_writing_history(tmp_path,
+        capsys):
+    config = tmp_path / "monitor.conf"
+    config.write_text(f"[general]\nhistory_dir = {tmp_path / 'history'}\n"
+            "consensus_quorum = 1\n\n[t1]\nproto = icmp\ndest = 127.0.0.1\n")
+    recorder = capture.Recorder(str(tmp_path / "capture"))
+    for index in range(3):
+        conn_id = recorder.open((f"10.0.0.{index}", 1000))
+        recorder.frames(conn_id, [f"NAME:t{index}", "CONFIG_REQUEST:zlib"] +
+                ['STATS_UPDATE:{"t1": 0.01}'] * 10)
+    recorder.close(0)
+    recorder.shutdown()
+    replay.main([str(config), str(tmp_path / "capture"), "--copies", "2"])
+    output = capsys.readouterr().out
+    assert "Frames: 72 " in output
+    assert "STATS_UPDATE                60" in output
+    assert not (tmp_path / "history").exists()
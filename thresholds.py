@@ -0,0 +1,41 @@
+"""Detection of latency threshold crossings"""
+
+import logging
+
+import history
+
+log = logging.getLogger(__name__)
+
+class Thresholds:
+    """Latency limits per target, from threshold field or general default"""
+    def __init__(self, conf, default=None):
+        self.default = default
+        self.limits = {}
+        for name, subconf in conf.items():
+            if name == "general" or "threshold" not in subconf:
+                continue
+            try:
+                self.limits[name] = float(subconf["threshold"])
+            except ValueError:
+                log.error("Invalid threshold %s for %s",
+                        subconf["threshold"], name)
+        self.above = {}
+
+    def check(self, timestamp, tester, results):
+        """Return events for results that crossed their limit"""
+        events = []
+        for target, result in results.items():
+            limit = self.limits.get(target, self.default)
+            if limit is None:
+                continue
+            value = history.to_value(result)
+            if value < 0:
+                continue
+            above = value > limit
+            key = (tester, target)
+            if self.above.get(key, False) != above:
+                self.above[key] = above
+                events.append({"type": "threshold", "target": target,
+                    "tester": tester, "value": value, "limit": limit,
+                    "above": above, "time": timestamp})
+        return events
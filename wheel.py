@@ -0,0 +1,51 @@
+"""Hashed timer wheel for idle timeouts of many connections"""
+
+import math
+
+class TimerWheel:
+    """Keys expire timeout after their last touch, checked once per tick"""
+    def __init__(self, timeout, tick=1.0):
+        self.timeout = timeout
+        self.tick = tick
+        self.slots = [set() for _ in range(math.ceil(timeout / tick) + 1)]
+        # Deadline tick of every key, its slot is deadline modulo slots
+        self.deadlines = {}
+        self.current = None
+
+    def touch(self, key, now):
+        """Move deadline of key to timeout from now"""
+        deadline = math.ceil((now + self.timeout) / self.tick)
+        previous = self.deadlines.get(key)
+        if previous == deadline:
+            return
+        if previous is not None:
+            self.slots[previous % len(self.slots)].discard(key)
+        self.slots[deadline % len(self.slots)].add(key)
+        self.deadlines[key] = deadline
+
+    def remove(self, key):
+        """Stop tracking key"""
+        deadline = self.deadlines.pop(key, None)
+        if deadline is not None:
+            self.slots[deadline % len(self.slots)].discard(key)
+
+    def advance(self, now):
+        """Turn wheel to now, return keys whose deadline passed"""
+        tick = math.floor(now / self.tick)
+        if self.current is None:
+            self.current = tick
+        expired = []
+        # Every slot is visited once however long the loop stalled
+        for passed in range(self.current + 1,
+                min(tick, self.current + len(self.slots)) + 1):
+            slot = self.slots[passed % len(self.slots)]
+            if not slot:
+                continue
+            # Key touched far ahead of wheel waits for a later turn
+            due = [key for key in slot if self.deadlines[key] <= tick]
+            for key in due:
+                slot.discard(key)
+                del self.deadlines[key]
+            expired.extend(due)
+        self.current = max(self.current, tick)
+        return expired